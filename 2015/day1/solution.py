@@ -46,6 +46,22 @@
 # basement?
 
 import pytest
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+import numpy as np
+import mmap
+import struct
+import os
+
+CHUNK_SIZE: int = 1 << 20 # bytes per scanned chunk
+
+# Floor change for every possible byte; anything but a parenthesis is ignored.
+FLOOR_STEPS: np.ndarray = np.zeros(256, dtype=np.int64)
+FLOOR_STEPS[ord('(')] = 1
+FLOOR_STEPS[ord(')')] = -1
+
+INDEX_HEADER: struct.Struct = struct.Struct('=qq') # (length, leaves), native order like the trees
+INDEX_PAD: int = 1 << 62 # filler for the unused leaves of the trees
 
 def sum_parens(s: str) -> int:
     "Sum the value of a string of parenthesis, '(' being 1 and ')' being -1."
@@ -81,6 +97,140 @@ def solve2(puzzle: str) -> int:
         data: str = p.read().strip()
         return enter_basement_at(data)
 
+def chunk_walk(chunk: bytes) -> np.ndarray:
+    """Return the floors reached after every byte of chunk (as an int64 array),
+    relative to the floor the chunk starts at."""
+    return np.cumsum(FLOOR_STEPS[np.frombuffer(chunk, dtype=np.uint8)])
+
+def chunk_floors(chunk: bytes) -> tuple[int, int]:
+    """Return the net floor delta of chunk and the lowest floor reached inside
+    it, both relative to the floor the chunk starts at."""
+    if not chunk: return (0, 0)
+    floors: np.ndarray = chunk_walk(chunk)
+    return (int(floors[-1]), int(floors.min()))
+
+def scan_chunk(puzzle: str, start: int, size: int) -> tuple[int, int]:
+    "Read size bytes of puzzle from offset start and return its chunk_floors."
+    with open(puzzle, 'rb') as p:
+        with mmap.mmap(p.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return chunk_floors(m[start : start + size])
+
+def scan_floors(puzzle: str, chunk_size: int = CHUNK_SIZE,
+                workers: int | None = None) -> tuple[int, int | None]:
+    """Return the last floor reached following the puzzle file and the position
+    (index 1) of the first parenthesis that enters the basement, or None if
+    Santa never gets there.
+
+    The file is split in chunks of chunk_size bytes whose delta and lowest floor
+    are computed by a pool of workers; the chunks are then walked in order and
+    only the one crossing into the basement is walked again to find it."""
+    size: int = os.path.getsize(puzzle)
+    starts: range = range(0, size, chunk_size)
+    floor: int = 0
+    basement: int | None = None
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = pool.map(scan_chunk, [puzzle] * len(starts), starts,
+                          [chunk_size] * len(starts))
+
+        for start, (delta, lowest) in zip(starts, chunks):
+            if basement is None and floor + lowest < 0:
+                with open(puzzle, 'rb') as p:
+                    p.seek(start)
+                    chunk: bytes = p.read(chunk_size)
+                below: np.ndarray = floor + chunk_walk(chunk) < 0
+                basement = start + int(below.argmax()) + 1
+            floor += delta
+
+    return (floor, basement)
+
+class FloorIndex:
+    """Floors after every position of an instruction string, stored as the
+    leaves of a min and a max segment tree (int64, 1-indexed, leaves from
+    index 'leaves' on) so range and threshold queries take O(log n)."""
+
+    def __init__(self, length: int, leaves: int,
+                 mins: array | memoryview, maxs: array | memoryview):
+        self.length = length # number of instructions
+        self.leaves = leaves # power of two >= length + 1
+        self.mins = mins
+        self.maxs = maxs
+
+    @classmethod
+    def build(cls, s: str) -> 'FloorIndex':
+        "Build the index of the floors reached following instructions s."
+        floors = array('q', [0]) + array('q', chunk_walk(s.encode()).tobytes())
+        leaves: int = 1 << (len(floors) - 1).bit_length()
+        padding: int = leaves - len(floors)
+        mins = array('q', [0]) * leaves + floors + array('q', [INDEX_PAD]) * padding
+        maxs = array('q', [0]) * leaves + floors + array('q', [-INDEX_PAD]) * padding
+        for node in range(leaves - 1, 0, -1):
+            mins[node] = min(mins[2 * node], mins[2 * node + 1])
+            maxs[node] = max(maxs[2 * node], maxs[2 * node + 1])
+
+        return cls(len(floors) - 1, leaves, mins, maxs)
+
+    def save(self, path: str) -> None:
+        "Write the index to path so that it can be memory-mapped by load."
+        with open(path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(self.length, self.leaves))
+            f.write(self.mins)
+            f.write(self.maxs)
+
+    @classmethod
+    def load(cls, path: str) -> 'FloorIndex':
+        "Memory-map an index written by save without rebuilding it."
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        length, leaves = INDEX_HEADER.unpack_from(m)
+        trees = memoryview(m)[INDEX_HEADER.size:].cast('q')
+
+        return cls(length, leaves, trees[: 2 * leaves], trees[2 * leaves :])
+
+    def floor_at(self, pos: int) -> int:
+        "Return the floor after the first pos instructions (floor_at(0) is 0)."
+        if not 0 <= pos <= self.length:
+            raise IndexError(f"Position out of range: {pos}")
+        return self.mins[self.leaves + pos]
+
+    def floor_range(self, i: int, j: int) -> tuple[int, int]:
+        "Return the lowest and highest floors between positions i and j (inclusive)."
+        if not 0 <= i <= j <= self.length:
+            raise IndexError(f"Range out of bounds: [{i}, {j}]")
+        lo: int = i + self.leaves
+        hi: int = j + self.leaves + 1
+        lowest: int = INDEX_PAD
+        highest: int = -INDEX_PAD
+        while lo < hi:
+            if lo & 1:
+                lowest = min(lowest, self.mins[lo])
+                highest = max(highest, self.maxs[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                lowest = min(lowest, self.mins[hi])
+                highest = max(highest, self.maxs[hi])
+            lo >>= 1
+            hi >>= 1
+
+        return (lowest, highest)
+
+    def first_reaching(self, floor: int) -> int | None:
+        """Return the first position (index 1) after which Santa is on floor,
+        or None if he never gets there. Floors change one at a time, so this
+        is the first position at or beyond floor."""
+        if floor == 0: return 0
+        if floor < 0 and self.mins[1] > floor: return None
+        if floor > 0 and self.maxs[1] < floor: return None
+
+        node: int = 1
+        while node < self.leaves:
+            node *= 2
+            if floor < 0 and self.mins[node] > floor: node += 1
+            if floor > 0 and self.maxs[node] < floor: node += 1
+
+        return node - self.leaves
+
 ### TESTS
 
 def test_solve1():
@@ -103,3 +253,52 @@ def test_sum_parens():
     assert sum_parens('))(')     == -1
     assert sum_parens(')))')     == -3
     assert sum_parens(')())())') == -3
+
+def test_chunk_floors():
+    assert chunk_floors(b'') == (0, 0)
+    assert chunk_floors(b'(((') == (3, 1)
+    assert chunk_floors(b'))(((((') == (3, -2)
+    assert chunk_floors(b'()())\n') == (-1, -1)
+
+def test_scan_floors():
+    assert scan_floors('./puzzle') == (solve1('./puzzle'), solve2('./puzzle'))
+    assert scan_floors('./puzzle', chunk_size=7) == (74, 1795)
+    assert scan_floors('./puzzle', chunk_size=1795) == (74, 1795)
+
+def test_scan_floors_never_in_basement(tmp_path):
+    puzzle = tmp_path / 'puzzle'
+    puzzle.write_text('(()(()(\n')
+    assert scan_floors(str(puzzle), chunk_size=2) == (3, None)
+
+def test_floor_index():
+    index = FloorIndex.build('()())')
+    assert [index.floor_at(p) for p in range(6)] == [0, 1, 0, 1, 0, -1]
+    assert index.floor_range(0, 5) == (-1, 1)
+    assert index.floor_range(2, 2) == (0, 0)
+    assert index.first_reaching(-1) == enter_basement_at('()())')
+    assert index.first_reaching(1) == 1
+    assert index.first_reaching(2) is None
+    with pytest.raises(IndexError):
+        index.floor_at(6)
+
+def test_floor_index_puzzle(tmp_path):
+    with open('./puzzle') as p:
+        data = p.read().strip()
+    index = FloorIndex.build(data)
+    assert index.floor_at(len(data)) == sum_parens(data)
+    assert index.first_reaching(-1) == enter_basement_at(data)
+    lowest, highest = index.floor_range(0, len(data))
+    assert index.first_reaching(lowest) is not None
+    assert index.first_reaching(lowest - 1) is None
+    assert index.first_reaching(highest + 1) is None
+
+    index.save(tmp_path / 'index')
+    loaded = FloorIndex.load(tmp_path / 'index')
+    assert loaded.floor_at(len(data)) == 74
+    assert loaded.first_reaching(-1) == 1795
+    assert loaded.floor_range(100, 2000) == index.floor_range(100, 2000)
+
+    # Header and trees share the byte order, so the file is one array('q')
+    words = array('q', (tmp_path / 'index').read_bytes())
+    assert words[:2].tolist() == [len(data), index.leaves]
+    assert words[2:] == index.mins + index.maxs
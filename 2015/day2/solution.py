@@ -52,12 +52,20 @@
 import pytest
 from typing import NewType
 from io import IOBase
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import hashlib
+import json
+import os
 import re
 
 Dimensions: type = NewType('Dimensions', list[int])
+Columns: type = tuple[np.ndarray, np.ndarray, np.ndarray]
 
 PUZZLE_FILE: str = "./puzzle"
 TEST_FILE: str = "./test"
+BLOCK_SIZE: int = 1 << 22 # bytes read at a time by aggregate_shard
+LEDGER_WINDOW: int = 1 << 12 # bytes before the checkpoint offset that get hashed
 
 def parse_puzzle(puzzle: IOBase) -> list[Dimensions]:
     "Parse the puzzle file into a list of Dimensions"
@@ -104,6 +112,140 @@ def solve2(puzzle: str) -> int:
         boxes: list[Dimensions] = parse_puzzle(p)
         return sum((get_required_ribbon(b) for b in boxes))
 
+def parse_puzzle_columns(data: bytes) -> Columns:
+    """Parse the whole 'LxWxH' puzzle data at once into three contiguous int64
+    arrays (lengths, widths and heights) without creating per-box objects."""
+    buf: np.ndarray = np.frombuffer(data, dtype=np.uint8)
+    digit: np.ndarray = (buf >= ord('0')) & (buf <= ord('9'))
+    starts: np.ndarray = np.flatnonzero(digit & ~np.r_[False, digit[:-1]])
+    ends: np.ndarray = np.flatnonzero(digit & ~np.r_[digit[1:], False]) + 1
+    if len(starts) % 3:
+        raise ValueError("Puzzle data isn't a list of 'LxWxH' dimensions")
+
+    # Horner's rule over the digit positions, one array pass per digit
+    values: np.ndarray = np.zeros(len(starts), dtype=np.int64)
+    for k in range(int((ends - starts).max(initial=0))):
+        pos: np.ndarray = starts + k
+        inside: np.ndarray = pos < ends
+        digits: np.ndarray = buf[np.minimum(pos, len(buf) - 1)] - ord('0')
+        values = np.where(inside, values * 10 + digits, values)
+
+    boxes: np.ndarray = values.reshape(-1, 3)
+    return tuple(np.ascontiguousarray(boxes[:, i]) for i in range(3))
+
+def get_total_paper(l: np.ndarray, w: np.ndarray, h: np.ndarray) -> int:
+    "Vectorized sum of get_required_paper over every box in the columns."
+    smallest, middle, __ = np.sort(np.stack((l, w, h)), axis=0)
+    return int((2 * (l*w + w*h + h*l) + smallest * middle).sum())
+
+def get_total_ribbon(l: np.ndarray, w: np.ndarray, h: np.ndarray) -> int:
+    "Vectorized sum of get_required_ribbon over every box in the columns."
+    smallest, middle, __ = np.sort(np.stack((l, w, h)), axis=0)
+    return int((2 * (smallest + middle) + l*w*h).sum())
+
+def bulk_solve1(puzzle: str) -> int:
+    with open(puzzle, 'rb') as p:
+        return get_total_paper(*parse_puzzle_columns(p.read()))
+
+def bulk_solve2(puzzle: str) -> int:
+    with open(puzzle, 'rb') as p:
+        return get_total_ribbon(*parse_puzzle_columns(p.read()))
+
+def shard_offsets(puzzle: str, shards: int) -> list[tuple[int, int]]:
+    "Split puzzle in up to shards (start, end) byte ranges aligned to lines."
+    size: int = os.path.getsize(puzzle)
+    bounds: list[int] = [0]
+    with open(puzzle, 'rb') as p:
+        for i in range(1, shards):
+            pos: int = max(size * i // shards, bounds[-1])
+            if pos > 0:
+                # Move to the start of the line following byte pos - 1
+                p.seek(pos - 1)
+                p.readline()
+                pos = min(p.tell(), size)
+            bounds.append(pos)
+    bounds.append(size)
+
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+def aggregate_shard(puzzle: str, start: int, end: int) -> tuple[int, int]:
+    """Return the required paper and ribbon of the boxes between byte offsets
+    start and end of puzzle, reading at most BLOCK_SIZE bytes at a time."""
+    paper: int = 0
+    ribbon: int = 0
+    with open(puzzle, 'rb') as p:
+        p.seek(start)
+        rest: bytes = b''
+        while start < end:
+            block: bytes = rest + p.read(min(BLOCK_SIZE, end - start))
+            start = p.tell()
+            cut: int = block.rfind(b'\n') + 1 if start < end else len(block)
+            block, rest = block[:cut], block[cut:]
+            columns: Columns = parse_puzzle_columns(block)
+            paper += get_total_paper(*columns)
+            ribbon += get_total_ribbon(*columns)
+
+    return (paper, ribbon)
+
+def aggregate(puzzle: str, workers: int | None = None) -> tuple[int, int]:
+    """Return the required paper and ribbon (answers of solve1 and solve2) in
+    a single pass, with every worker of a process pool summing one shard."""
+    workers = workers or os.cpu_count() or 1
+    shards: list[tuple[int, int]] = shard_offsets(puzzle, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        partials = pool.map(aggregate_shard, [puzzle] * len(shards),
+                            *zip(*shards))
+        paper, ribbon = 0, 0
+        for p, r in partials:
+            paper += p
+            ribbon += r
+
+    return (paper, ribbon)
+
+def prefix_digest(puzzle: IOBase, offset: int) -> str:
+    "Return the SHA-256 of the LEDGER_WINDOW bytes of puzzle ending at offset."
+    start: int = max(0, offset - LEDGER_WINDOW)
+    puzzle.seek(start)
+    return hashlib.sha256(puzzle.read(offset - start)).hexdigest()
+
+def update_ledger(puzzle: str, checkpoint: str) -> tuple[int, int]:
+    """Return the required paper and ribbon of an append-only puzzle file,
+    only parsing the lines appended since the last call.
+
+    The checkpoint file keeps the byte offset processed so far, the running
+    totals and a hash of the bytes right before the offset. If the file got
+    shorter or those bytes changed, everything is recomputed from byte 0. A
+    trailing line without newline is left for the next call."""
+    ledger: dict = {'offset': 0, 'paper': 0, 'ribbon': 0, 'digest': None}
+    try:
+        with open(checkpoint) as c:
+            saved = json.load(c)
+        if isinstance(saved, dict) and saved.keys() == ledger.keys():
+            ledger = saved
+    except (FileNotFoundError, ValueError): # unreadable: recompute everything
+        pass
+
+    with open(puzzle, 'rb') as p:
+        size: int = p.seek(0, os.SEEK_END)
+        if (ledger['offset'] > size or
+            prefix_digest(p, ledger['offset']) != ledger['digest']):
+            ledger = {'offset': 0, 'paper': 0, 'ribbon': 0}
+
+        p.seek(ledger['offset'])
+        appended: bytes = p.read()
+        appended = appended[: appended.rfind(b'\n') + 1]
+        boxes: list[Dimensions] = parse_puzzle(appended.decode().splitlines())
+        ledger['paper'] += sum((get_required_paper(b) for b in boxes))
+        ledger['ribbon'] += sum((get_required_ribbon(b) for b in boxes))
+        ledger['offset'] += len(appended)
+        ledger['digest'] = prefix_digest(p, ledger['offset'])
+
+    with open(f"{checkpoint}.tmp", 'w') as c:
+        json.dump(ledger, c)
+    os.replace(f"{checkpoint}.tmp", checkpoint)
+
+    return (ledger['paper'], ledger['ribbon'])
+
 ### TEST
 
 def test_solve1():
@@ -126,3 +268,71 @@ def test_get_required_paper():
 def test_get_required_ribbon():
     assert get_required_ribbon([2, 3, 4]) == 34
     assert get_required_ribbon([1, 1, 10]) == 14
+
+def test_parse_puzzle_columns():
+    l, w, h = parse_puzzle_columns(b'2x3x4\n1x1x10\n')
+    assert l.tolist() == [2, 1]
+    assert w.tolist() == [3, 1]
+    assert h.tolist() == [4, 10]
+    assert all(c.flags['C_CONTIGUOUS'] for c in (l, w, h))
+    assert [c.tolist() for c in parse_puzzle_columns(b'')] == [[], [], []]
+    with pytest.raises(ValueError):
+        parse_puzzle_columns(b'2x3\n')
+
+def test_bulk_solve():
+    assert bulk_solve1(TEST_FILE) == solve1(TEST_FILE)
+    assert bulk_solve1(PUZZLE_FILE) == solve1(PUZZLE_FILE)
+    assert bulk_solve2(TEST_FILE) == solve2(TEST_FILE)
+    assert bulk_solve2(PUZZLE_FILE) == solve2(PUZZLE_FILE)
+
+def test_shard_offsets():
+    assert shard_offsets(TEST_FILE, 1) == [(0, 13)]
+    assert shard_offsets(TEST_FILE, 2) == [(0, 6), (6, 13)]
+    assert shard_offsets(TEST_FILE, 20) == [(0, 6), (6, 13)]
+    shards = shard_offsets(PUZZLE_FILE, 7)
+    assert len(shards) == 7
+    assert all(a[1] == b[0] for a, b in zip(shards, shards[1:]))
+
+def test_aggregate_shard():
+    assert aggregate_shard(TEST_FILE, 0, 6) == (58, 34)
+    assert aggregate_shard(TEST_FILE, 6, 13) == (43, 14)
+
+def test_aggregate(monkeypatch):
+    answers = (solve1(PUZZLE_FILE), solve2(PUZZLE_FILE))
+    assert aggregate(TEST_FILE) == (58 + 43, 34 + 14)
+    assert aggregate(PUZZLE_FILE, workers=3) == answers
+    monkeypatch.setattr('solution.BLOCK_SIZE', 100)
+    assert aggregate_shard(PUZZLE_FILE, 0, os.path.getsize(PUZZLE_FILE)) == answers
+
+def test_update_ledger(tmp_path):
+    puzzle = tmp_path / 'puzzle'
+    checkpoint = tmp_path / 'checkpoint'
+    puzzle.write_text('2x3x4\n')
+    assert update_ledger(puzzle, checkpoint) == (58, 34)
+    assert update_ledger(puzzle, checkpoint) == (58, 34)
+
+    # Only complete lines are accounted for
+    with open(puzzle, 'a') as p:
+        p.write('1x1x10\n1x1')
+    assert update_ledger(puzzle, checkpoint) == (58 + 43, 34 + 14)
+    with open(puzzle, 'a') as p:
+        p.write('x10\n')
+    assert update_ledger(puzzle, checkpoint) == (58 + 43 * 2, 34 + 14 * 2)
+
+    # A rewritten prefix triggers a full recompute
+    puzzle.write_text('1x1x10\n1x1x10\n2x3x4\n')
+    assert update_ledger(puzzle, checkpoint) == (58 + 43 * 2, 34 + 14 * 2)
+    puzzle.write_text('1x1x10\n')
+    assert update_ledger(puzzle, checkpoint) == (43, 14)
+
+    # A checkpoint cut short by a crash is recomputed
+    checkpoint.write_text('{"offset": 7, "pap')
+    assert update_ledger(puzzle, checkpoint) == (43, 14)
+    assert json.loads(checkpoint.read_text())['offset'] == 7
+    checkpoint.write_text('[7, 43, 14]')
+    assert update_ledger(puzzle, checkpoint) == (43, 14)
+
+def test_update_ledger_puzzle(tmp_path):
+    checkpoint = tmp_path / 'checkpoint'
+    assert update_ledger(PUZZLE_FILE, checkpoint) == (1586300, 3737498)
+    assert update_ledger(PUZZLE_FILE, checkpoint) == (1586300, 3737498)
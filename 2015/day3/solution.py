@@ -47,91 +47,296 @@
 #     direction and Robo-Santa going the other.
 
 import pytest
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import sys
 
 PUZZLE_FILE: str = './puzzle'
 TEST_FILE: str = './test'
+PACK_OFFSET: int = 1 << 31 # shifts coordinates to unsigned before packing
+WALK_BLOCK: int = 1 << 20 # moves per agent walked at a time
+TILE_SHIFT: int = 6
+TILE_SIDE: int = 1 << TILE_SHIFT # houses per tile side
+TILE_MASK: int = TILE_SIDE - 1
+TILE_BYTES: int = TILE_SIDE ** 2 // 8
+POPCOUNT: np.ndarray = np.array([bin(b).count('1') for b in range(256)], dtype=np.uint8)
+
+# Moves along each axis for every possible direction byte.
+DIRECTION_DX: np.ndarray = np.zeros(256, dtype=np.int64)
+DIRECTION_DY: np.ndarray = np.zeros(256, dtype=np.int64)
+DIRECTION_DX[[ord('>'), ord('<')]] = [1, -1]
+DIRECTION_DY[[ord('^'), ord('v')]] = [1, -1]
+VALID_DIRECTION: np.ndarray = (DIRECTION_DX != 0) | (DIRECTION_DY != 0)
+MOVES: dict[int, tuple[int, int]] = {ord('^'): (0, 1), ord('v'): (0, -1),
+                                     ord('>'): (1, 0), ord('<'): (-1, 0)}
+
+def agent_paths(moves: np.ndarray, agents: int, x: np.ndarray,
+                y: np.ndarray) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Yield the coordinates visited by every agent taking turns to follow
+    the (valid) direction bytes in moves, starting from the positions in x
+    and y, which are updated in place."""
+    for agent in range(agents):
+        xs: np.ndarray = x[agent] + np.cumsum(DIRECTION_DX[moves[agent::agents]])
+        ys: np.ndarray = y[agent] + np.cumsum(DIRECTION_DY[moves[agent::agents]])
+        if len(xs): x[agent], y[agent] = xs[-1], ys[-1]
+        yield (xs, ys)
+
+def walk_blocks(directions: str | bytes, agents: int = 1,
+                block: int = WALK_BLOCK) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Yield the x and y coordinates (as int64 arrays) of the houses visited by
+    agents taking turns to follow directions, starting with the shared origin
+    house and then at most block moves of one agent at a time. The walk stops
+    at the first invalid direction."""
+    if isinstance(directions, str): directions = directions.encode()
+    moves: np.ndarray = np.frombuffer(directions, dtype=np.uint8)
+    x: np.ndarray = np.zeros(agents, dtype=np.int64)
+    y: np.ndarray = np.zeros(agents, dtype=np.int64)
+
+    yield (np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+    for start in range(0, len(moves), block * agents):
+        chunk: np.ndarray = moves[start : start + block * agents]
+        invalid: np.ndarray = np.flatnonzero(~VALID_DIRECTION[chunk])
+        if len(invalid): chunk = chunk[: invalid[0]]
+
+        yield from agent_paths(chunk, agents, x, y)
+        if len(invalid): break
+
+def pack(xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    "Pack x and y coordinates into uint64 keys (x in the high 32 bits)."
+    return ((xs + PACK_OFFSET).astype(np.uint64) << np.uint64(32)) | \
+        (ys + PACK_OFFSET).astype(np.uint64)
+
+def unpack(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    "Return the x and y coordinates (as int64 arrays) packed into keys."
+    return ((keys >> np.uint64(32)).astype(np.int64) - PACK_OFFSET,
+            (keys & np.uint64(0xffffffff)).astype(np.int64) - PACK_OFFSET)
 
 @dataclass
-class Point:
-    x: int
-    y: int
-
-def is_south(d: str) -> bool:
-    return d == 'v'
-
-def is_north(d: str) -> bool:
-    return d == '^'
-
-def is_east(d: str) -> bool:
-    return d == '>'
-
-def is_west(d: str) -> bool:
-    return d == '<'
-
-def delivered(directions: str) -> int:
-    "Calculate how many houses got delivered at least one present"
-    loc: Point = Point(0, 0)
-    visited: list[Point] = [loc]
-
-    for d in directions:
-
-        if is_north(d):
-            loc = Point(loc.x, loc.y + 1)
-        elif is_south(d):
-            loc = Point(loc.x, loc.y - 1)
-        elif is_east(d):
-            loc = Point(loc.x + 1, loc.y)
-        elif is_west(d):
-            loc = Point(loc.x - 1, loc.y)
-        else:
-            break
-
-        visited.append(loc)
-
-    return len({(l.x, l.y) for l in visited})
-
-def robo_delivered(directions: str) -> int:
-    turn: str            = 'santa' # 'santa' or 'robot'
-    sloc: Point          = Point(0, 0)
-    rloc: Point          = Point(0, 0)
-    visited: list[Point] = [Point(0, 0)]
-
-    for d in directions:
-
-        if turn == 'santa':
-
-            if is_north(d):
-                sloc = Point(sloc.x, sloc.y + 1)
-            elif is_south(d):
-                sloc = Point(sloc.x, sloc.y - 1)
-            elif is_east(d):
-                sloc = Point(sloc.x + 1, sloc.y)
-            elif is_west(d):
-                sloc = Point(sloc.x - 1, sloc.y)
-            else:
-                break
-
-            visited.append(sloc)
-            turn = 'robot'
+class TiledBitmap:
+    """Sparse set of houses made of TILE_SIDE by TILE_SIDE bitmap tiles (one
+    bit per house), allocated on demand as rows of a single uint8 array that
+    doubles when full; tiles maps packed tile coordinates to their row."""
+    tiles: dict[int, int] = field(default_factory=dict)
+    bitmaps: np.ndarray = field(default_factory=lambda: np.zeros((1, TILE_BYTES), dtype=np.uint8))
+
+    def add(self, xs: np.ndarray, ys: np.ndarray) -> None:
+        "Mark the houses at coordinates xs and ys as visited."
+        if not len(xs): return
+        keys, where = np.unique(pack(xs >> TILE_SHIFT, ys >> TILE_SHIFT), return_inverse=True)
+        bits: np.ndarray = ((xs & TILE_MASK) << TILE_SHIFT) | (ys & TILE_MASK)
+
+        rows: np.ndarray = np.array([self.tiles.setdefault(k, len(self.tiles))
+                                     for k in keys.tolist()], dtype=np.int64)
+        if len(self.tiles) > len(self.bitmaps):
+            grown: np.ndarray = np.zeros((max(len(self.tiles), 2 * len(self.bitmaps)), TILE_BYTES),
+                                         dtype=np.uint8)
+            grown[: len(self.bitmaps)] = self.bitmaps
+            self.bitmaps = grown
+        np.bitwise_or.at(self.bitmaps.reshape(-1), rows[where.ravel()] * TILE_BYTES + (bits >> 3),
+                         np.left_shift(1, bits & 7).astype(np.uint8))
+
+    def __len__(self) -> int:
+        "Return the number of visited houses."
+        return int(POPCOUNT[self.bitmaps[: len(self.tiles)]].sum(dtype=np.int64))
+
+    @property
+    def nbytes(self) -> int:
+        """Return the bytes used by the tile array (including its rows not in
+        use yet) and by the dict of tiles with its keys and rows."""
+        return (self.bitmaps.nbytes + sys.getsizeof(self.tiles) +
+                sum(sys.getsizeof(k) + sys.getsizeof(r) for k, r in self.tiles.items()))
+
+    def stats(self) -> dict:
+        "Return the number of tiles and houses, memory used and tile fill ratio."
+        houses: int = len(self)
+        return {'tiles': len(self.tiles),
+                'houses': houses,
+                'bytes': self.nbytes,
+                'fill': houses / (len(self.tiles) * TILE_SIDE ** 2) if self.tiles else 0.0}
+
+def visited_houses(directions: str | bytes, agents: int = 1) -> TiledBitmap:
+    "Return the TiledBitmap of houses visited by agents following directions."
+    visited: TiledBitmap = TiledBitmap()
+    for xs, ys in walk_blocks(directions, agents):
+        visited.add(xs, ys)
+
+    return visited
+
+def houses_delivered(directions: str | bytes, agents: int = 1) -> int:
+    """Calculate how many houses got delivered at least one present by agents
+    taking turns to follow directions."""
+    return len(visited_houses(directions, agents))
 
-        elif turn == 'robot':
-
-            if is_north(d):
-                rloc = Point(rloc.x, rloc.y + 1)
-            elif is_south(d):
-                rloc = Point(rloc.x, rloc.y - 1)
-            elif is_east(d):
-                rloc = Point(rloc.x + 1, rloc.y)
-            elif is_west(d):
-                rloc = Point(rloc.x - 1, rloc.y)
-            else:
+@dataclass
+class VisitIndex:
+    """Number of presents delivered to every visited house: sorted packed
+    coordinates (keys) and their uint32 visit counts."""
+    keys: np.ndarray
+    counts: np.ndarray
+
+    def __post_init__(self):
+        self.sorted_counts: np.ndarray = np.sort(self.counts)
+
+    @classmethod
+    def build(cls, directions: str | bytes, agents: int = 1) -> 'VisitIndex':
+        """Build the index of the presents delivered by agents taking turns to
+        follow directions; every agent delivers one at the origin house."""
+        keys: np.ndarray = np.zeros(0, dtype=np.uint64)
+        counts: np.ndarray = np.zeros(0, dtype=np.uint32)
+        for xs, ys in walk_blocks(directions, agents):
+            block_keys, block_counts = np.unique(pack(xs, ys), return_counts=True)
+            keys, inverse = np.unique(np.concatenate((keys, block_keys)),
+                                      return_inverse=True)
+            counts = np.bincount(inverse, np.concatenate((counts, block_counts)),
+                                 minlength=len(keys)).astype(np.uint32)
+
+        counts[np.searchsorted(keys, pack(np.int64(0), np.int64(0)))] += agents - 1
+        return cls(keys, counts)
+
+    def __len__(self) -> int:
+        "Return the number of houses that got at least one present."
+        return len(self.keys)
+
+    def at_least(self, k: int) -> int:
+        "Return how many houses got at least k presents."
+        return len(self.sorted_counts) - int(np.searchsorted(self.sorted_counts, k))
+
+    def top(self, n: int) -> list[tuple[tuple[int, int], int]]:
+        """Return the n most visited houses as ((x, y), presents), most visited
+        first and ties ordered by coordinates."""
+        order: np.ndarray = np.argsort(-self.counts.astype(np.int64), kind='stable')[:n]
+        xs, ys = unpack(self.keys[order])
+        return list(zip(zip(xs.tolist(), ys.tolist()), self.counts[order].tolist()))
+
+    def visits_in(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        "Return the presents delivered inside the rectangle of corners (x1, y1) and (x2, y2)."
+        x1, x2 = sorted((x1, x2))
+        y1, y2 = sorted((y1, y2))
+        # Keys sort by x then y, so the rectangle lies between its two corners
+        lo: int = np.searchsorted(self.keys, pack(np.int64(x1), np.int64(y1)))
+        hi: int = np.searchsorted(self.keys, pack(np.int64(x2), np.int64(y2)), side='right')
+        __, ys = unpack(self.keys[lo:hi])
+        return int(self.counts[lo:hi][(ys >= y1) & (ys <= y2)].sum())
+
+def chunk_displacement(chunk: bytes, agents: int) -> tuple[np.ndarray, np.ndarray, int]:
+    """Return how far each agent moves along x and y following chunk, and the
+    index of its first invalid direction (-1 if there is none); the moves
+    after an invalid direction don't count."""
+    moves: np.ndarray = np.frombuffer(chunk, dtype=np.uint8)
+    invalid: np.ndarray = np.flatnonzero(~VALID_DIRECTION[moves])
+    stop: int = int(invalid[0]) if len(invalid) else -1
+    if stop >= 0: moves = moves[:stop]
+    dx: np.ndarray = np.array([DIRECTION_DX[moves[a::agents]].sum() for a in range(agents)])
+    dy: np.ndarray = np.array([DIRECTION_DY[moves[a::agents]].sum() for a in range(agents)])
+
+    return (dx, dy, stop)
+
+def chunk_visited(chunk: bytes, agents: int, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Return the sorted packed coordinates of the houses visited following
+    the valid chunk, with every agent starting at its global position."""
+    moves: np.ndarray = np.frombuffer(chunk, dtype=np.uint8)
+    paths = list(agent_paths(moves, agents, x.copy(), y.copy()))
+    return np.unique(pack(np.concatenate([p[0] for p in paths]),
+                          np.concatenate([p[1] for p in paths])))
+
+def parallel_houses_delivered(directions: str | bytes, agents: int = 1,
+                              workers: int | None = None,
+                              chunk_size: int = WALK_BLOCK) -> int:
+    """Calculate the same as houses_delivered with a process pool. First every
+    chunk's displacement is computed, their prefix sums give the position
+    each agent starts each chunk at, and then the houses visited in every
+    chunk are collected in global coordinates and merged."""
+    if isinstance(directions, str): directions = directions.encode()
+    chunk_size = max(agents, chunk_size - chunk_size % agents) # keeps turns aligned
+    chunks: list[bytes] = [directions[i : i + chunk_size]
+                           for i in range(0, len(directions), chunk_size)]
+    xs: list[np.ndarray] = [np.zeros(agents, dtype=np.int64)]
+    ys: list[np.ndarray] = [np.zeros(agents, dtype=np.int64)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i, (dx, dy, stop) in enumerate(pool.map(chunk_displacement, chunks,
+                                                     [agents] * len(chunks))):
+            xs.append(xs[-1] + dx)
+            ys.append(ys[-1] + dy)
+            if stop >= 0:
+                chunks = chunks[:i] + [chunks[i][:stop]]
                 break
 
-            visited.append(rloc)
-            turn = 'santa'
+        visited = pool.map(chunk_visited, chunks, [agents] * len(chunks), xs, ys)
+        keys: np.ndarray = np.concatenate([pack(np.int64(0), np.int64(0))[None],
+                                           *visited])
 
-    return len({(l.x, l.y) for l in visited})
+    return len(np.unique(keys))
+
+@dataclass
+class HouseCounter:
+    """Online distinct-house counter: directions are fed in any number of
+    pieces and only the agents' positions and the packed coordinates of the
+    visited houses are kept between feeds."""
+    agents: int = 1
+
+    def __post_init__(self):
+        self.positions: list[tuple[int, int]] = [(0, 0)] * self.agents
+        self.visited: set[int] = {(PACK_OFFSET << 32) | PACK_OFFSET}
+        self.moves: int = 0
+        self.stopped: bool = False # an invalid direction ends the walk
+
+    def __len__(self) -> int:
+        "Return how many houses got delivered at least one present so far."
+        return len(self.visited)
+
+    def move(self, d: int) -> bool:
+        "Move the agent on turn following direction byte d; False once stopped."
+        if self.stopped or d not in MOVES:
+            self.stopped = True
+            return False
+        agent: int = self.moves % self.agents
+        dx, dy = MOVES[d]
+        x, y = self.positions[agent]
+        self.positions[agent] = (x + dx, y + dy)
+        self.visited.add(((x + dx + PACK_OFFSET) << 32) | (y + dy + PACK_OFFSET))
+        self.moves += 1
+        return True
+
+    def follow(self, directions: str | bytes) -> Iterator[int]:
+        "Follow a piece of directions, yielding the move count after each move."
+        if isinstance(directions, str): directions = directions.encode()
+        for d in directions:
+            if not self.move(d): break
+            yield self.moves
+
+    def feed(self, directions: str | bytes) -> int:
+        "Follow a piece of directions and return the houses delivered so far."
+        for __ in self.follow(directions): pass
+
+        return len(self)
+
+def running_delivered(stream: Iterable[str | bytes], agents: int = 1,
+                      every: int = 1) -> Iterator[int]:
+    """Yield the number of houses delivered so far every 'every' moves of
+    directions read piece by piece from stream (a file, socket reader or any
+    generator of str or bytes), and once more when it is exhausted."""
+    if every < 1:
+        raise ValueError(f"'every' must be a positive number of moves, not {every}")
+    counter: HouseCounter = HouseCounter(agents)
+    for piece in stream:
+        for moves in counter.follow(piece):
+            if moves % every == 0: yield len(counter)
+        if counter.stopped: break
+
+    yield len(counter)
+
+def delivered(directions: str, workers: int | None = None) -> int:
+    """Calculate how many houses got delivered at least one present; walk in
+    parallel when a number of workers is given."""
+    if workers: return parallel_houses_delivered(directions, 1, workers)
+    return houses_delivered(directions, agents=1)
+
+def robo_delivered(directions: str, workers: int | None = None) -> int:
+    if workers: return parallel_houses_delivered(directions, 2, workers)
+    return houses_delivered(directions, agents=2)
 
 def solve1(puzzle: str) -> int :
     with open(puzzle, 'r') as p:
@@ -164,3 +369,96 @@ def test_solve1():
 def test_solve2():
     assert solve2(TEST_FILE) == 11
     assert solve2(PUZZLE_FILE) == 2639
+
+def test_houses_delivered():
+    assert houses_delivered('^v^v^v^v^v', agents=1) == delivered('^v^v^v^v^v')
+    assert houses_delivered('^v^v^v^v^v', agents=2) == robo_delivered('^v^v^v^v^v')
+    assert houses_delivered('>>>', agents=3) == 2
+    assert houses_delivered(b'<<<<<<', agents=3) == 3
+
+def test_walk_blocks():
+    def walk(directions, agents=1, block=WALK_BLOCK):
+        return [(x, y) for xs, ys in walk_blocks(directions, agents, block)
+                for x, y in zip(xs.tolist(), ys.tolist())]
+
+    assert walk('^>v<') == [(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)]
+    assert walk('^>v<', agents=2) == [(0, 0), (0, 1), (0, 0), (1, 0), (0, 0)]
+    assert walk('>>x>>') == [(0, 0), (1, 0), (2, 0)]
+    assert len(list(walk_blocks('^>v<^>v<', agents=2, block=2))) == 1 + 2 * 2
+    assert set(walk('^>v<^>v<', 2, block=2)) == set(walk('^>v<^>v<', 2))
+    assert walk('>>x>>', block=1) == walk('>>x>>')
+
+def test_tiled_bitmap():
+    visited = TiledBitmap()
+    visited.add(np.array([0, 0, 63, 64, -1, -64, -65]), np.array([0, 0, 63, 0, -1, 5, 5]))
+    assert len(visited) == 6
+    stats = visited.stats()
+    assert stats['tiles'] == 5 and stats['houses'] == 6
+    assert stats['fill'] == 6 / (5 * TILE_SIDE ** 2)
+    assert 5 * TILE_BYTES < stats['bytes'] < 5 * TILE_BYTES + 1000 # plus the dict
+    visited.add(np.array([1, 1 << 20]), np.array([2, 1 << 20]))
+    assert len(visited) == 8 and visited.stats()['tiles'] == 6
+    assert TiledBitmap().stats()['fill'] == 0.0
+
+def test_visited_houses():
+    with open(PUZZLE_FILE) as p:
+        data = p.read().rstrip()
+    visited = visited_houses(data)
+    assert len(visited) == 2565
+    assert len(visited.tiles) * 512 < visited.nbytes < 2 * len(visited.tiles) * 600
+    assert len(visited_houses(data, agents=2)) == 2639
+
+def test_visit_index():
+    index = VisitIndex.build('^v^v^v^v^v')
+    assert len(index) == delivered('^v^v^v^v^v')
+    assert index.at_least(1) == 2
+    assert index.at_least(6) == 1
+    assert index.at_least(7) == 0
+    assert index.top(1) == [((0, 0), 6)]
+    assert index.visits_in(-5, -5, 5, 5) == 11
+    assert index.visits_in(0, 1, 0, 1) == 5
+    assert index.visits_in(1, 0, 5, 5) == 0
+
+    index = VisitIndex.build('^v', agents=2)
+    assert index.top(3) == [((0, 0), 2), ((0, -1), 1), ((0, 1), 1)]
+
+def test_visit_index_puzzle():
+    with open(PUZZLE_FILE) as p:
+        data = p.read().rstrip()
+    index = VisitIndex.build(data, agents=2)
+    assert len(index) == robo_delivered(data) == index.at_least(1)
+    assert index.counts.sum() == len(data) + 2
+    assert index.visits_in(-10 ** 6, -10 ** 6, 10 ** 6, 10 ** 6) == len(data) + 2
+
+def test_chunk_displacement():
+    dx, dy, stop = chunk_displacement(b'^>v<>>', 2)
+    assert (dx.tolist(), dy.tolist(), stop) == ([1, 1], [0, 0], -1)
+    dx, dy, stop = chunk_displacement(b'>>\n>', 1)
+    assert (dx.tolist(), dy.tolist(), stop) == ([2], [0], 2)
+
+def test_parallel_houses_delivered():
+    with open(PUZZLE_FILE) as p:
+        data = p.read().rstrip()
+    assert delivered(data, workers=2) == 2565
+    assert robo_delivered(data, workers=2) == 2639
+    for agents in (1, 2, 3):
+        for chunk_size in (97, 1000):
+            assert parallel_houses_delivered(data + '\n^^^', agents, 2, chunk_size) == \
+                houses_delivered(data, agents)
+    assert parallel_houses_delivered('', 2) == 1
+
+def test_house_counter():
+    counter = HouseCounter(agents=2)
+    assert counter.feed('^') == 2
+    assert counter.feed(b'v^v^v^v^v') == robo_delivered('^v^v^v^v^v')
+    assert counter.feed('\n^^^') == 11
+    assert counter.stopped and counter.moves == 10
+
+def test_running_delivered():
+    assert list(running_delivered(['^>', 'v<'])) == [2, 3, 4, 4, 4]
+    assert list(running_delivered(iter(['^v^v^', 'v^v^v']), 2, every=5)) == [6, 11, 11]
+    with pytest.raises(ValueError):
+        next(running_delivered(['^>'], every=0))
+    with open(PUZZLE_FILE, 'rb') as p:
+        counts = running_delivered(iter(lambda: p.read(100), b''), every=1000)
+        assert list(counts)[-1] == 2565
@@ -27,12 +27,24 @@
 
 # Now find one that starts with six zeroes.
 
-#import pytest
-from typing import Callable
+import pytest
+from typing import Callable, Iterator
+from itertools import count
+from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+import multiprocessing
 import hashlib
+import json
+import os
 import re
+import socket
+import time
 
 PUZZLE_KEY: str = 'yzbqklnj'
+BATCH_SIZE: int = 1 << 16 # suffixes per range handed to a worker
+CHECKPOINT_EVERY: int = 1 << 20 # suffixes searched between cache checkpoints
+QUEUE_LEASE: float = 300.0 # seconds a worker may hold a range of a work queue
+QUEUE_POLL: float = 0.5 # seconds between checks for expired leases
 
 def starts_with_five_zeroes(hex: str) -> bool:
     "Returns true if hex starts  with five zeroes ('00000...')"
@@ -60,11 +72,439 @@ def get_hash_key_num_suffix(key: str, pred: Callable) -> int:
 
     return suffix
 
+@dataclass(frozen=True)
+class DigestPredicate:
+    """Predicate over raw MD5 digest bytes: they must start with head and the
+    byte after it, masked with mask, must equal value."""
+    head: bytes
+    mask: int = 0
+    value: int = 0
+
+    def __call__(self, digest: bytes) -> bool:
+        return (digest.startswith(self.head) and
+                digest[len(self.head)] & self.mask == self.value)
+
+    def prefix(self) -> tuple[int, int]:
+        "Return the number of leading digest bits fixed and their value."
+        bits: int = 8 * len(self.head) + bin(self.mask).count('1')
+        value: int = int.from_bytes(self.head + bytes([self.value]), 'big')
+        return (bits, value >> (8 * (len(self.head) + 1) - bits))
+
+    def implies(self, other: 'DigestPredicate') -> bool:
+        "Return True if every digest satisfying self also satisfies other."
+        bits, value = self.prefix()
+        other_bits, other_value = other.prefix()
+        return bits >= other_bits and value >> (bits - other_bits) == other_value
+
+def compile_difficulty(spec: str) -> DigestPredicate:
+    """Compile a difficulty spec into a DigestPredicate. Specs are 'nibbles:N'
+    (N leading zero hex digits), 'bits:N' (N leading zero bits) or 'prefix:H'
+    (digest starts with hexadecimal H)."""
+    kind, __, arg = spec.partition(':')
+    match kind:
+        case 'nibbles':
+            bits, prefix = 4 * int(arg), 0
+        case 'bits':
+            bits, prefix = int(arg), 0
+        case 'prefix':
+            bits, prefix = 4 * len(arg), int(arg, 16) if arg else 0
+        case _:
+            raise ValueError("'spec' argument not valid: {}".format(spec))
+    if not 0 <= bits < 128:
+        raise ValueError("'spec' argument out of range: {}".format(spec))
+
+    # Left align the prefix bits on whole bytes and split off the last byte
+    whole, rest = divmod(bits, 8)
+    aligned: bytes = (prefix << (-bits % 8)).to_bytes(whole + bool(rest), 'big')
+    mask: int = (0xff << (8 - rest)) & 0xff
+    return DigestPredicate(aligned[:whole], mask, aligned[whole] if rest else 0)
+
+FIVE_ZEROES: DigestPredicate = compile_difficulty('nibbles:5')
+SIX_ZEROES: DigestPredicate = compile_difficulty('nibbles:6')
+DIGIT_TAILS: list[bytes] = [b'%02d' % i for i in range(100)]
+
+def find_digest_suffix(key: str, pred: DigestPredicate, start: int = 0,
+                       stop: int | None = None) -> int | None:
+    """Return the lowest suffix in [start, stop) whose MD5 digest with key
+    satisfies pred (None if there's none).
+
+    The key is hashed once; then, for every hundred suffixes, its MD5 state
+    is copied and fed the leading digits, and that state is copied again for
+    each of the precomputed two-digit tails."""
+    base = hashlib.md5(key.encode())
+    head, mask, value = pred.head, pred.mask, pred.value
+    n: int = len(head)
+    suffix: int = start
+
+    # Suffixes below 100 (no two-digit tail) or before a whole hundred
+    while (suffix < 100 or suffix % 100) and (stop is None or suffix < stop):
+        h = base.copy()
+        h.update(b'%d' % suffix)
+        if pred(h.digest()): return suffix
+        suffix += 1
+    if stop is not None and suffix >= stop: return None
+
+    # suffix is now a whole hundred, so every block is searched from tail 00
+    for block in count(suffix // 100):
+        if stop is not None and block * 100 >= stop: return None
+        leading = base.copy()
+        leading.update(b'%d' % block)
+        for tail, digits in enumerate(DIGIT_TAILS):
+            h = leading.copy()
+            h.update(digits)
+            d: bytes = h.digest()
+            if d.startswith(head) and d[n] & mask == value:
+                suffix = block * 100 + tail
+                return suffix if stop is None or suffix < stop else None
+
+class MiningCache:
+    """On-disk JSON store of Day 4 searches, keyed by secret key and difficulty
+    spec: the answer once known, otherwise the checkpoint below which no
+    suffix satisfies the spec."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: dict[str, dict[str, dict]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.records = json.load(f)
+
+    def save(self) -> None:
+        "Write the store, atomically replacing the previous file."
+        with open(f"{self.path}.tmp", 'w') as f:
+            json.dump(self.records, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def answer(self, key: str, spec: str) -> int | None:
+        return self.records.get(key, {}).get(spec, {}).get('answer')
+
+    def record(self, key: str, spec: str, answer: int | None = None,
+               checkpoint: int | None = None) -> None:
+        "Store the answer or a new checkpoint of a search and save the store."
+        entry: dict = self.records.setdefault(key, {}).setdefault(spec, {})
+        if answer is not None: entry['answer'] = answer
+        if checkpoint is not None: entry['checkpoint'] = checkpoint
+        self.save()
+
+    def resume_at(self, key: str, spec: str) -> int:
+        """Return the lowest suffix that may satisfy spec for key: the highest
+        checkpoint or answer of this spec or of any easier one (a digest that
+        satisfies spec satisfies those too)."""
+        pred: DigestPredicate = compile_difficulty(spec)
+        start: int = 0
+        for other, entry in self.records.get(key, {}).items():
+            if pred.implies(compile_difficulty(other)):
+                start = max(start, entry.get('answer', entry.get('checkpoint', 0)))
+
+        return start
+
+def cached_mine(key: str, spec: str, cache: str,
+                every: int = CHECKPOINT_EVERY) -> int:
+    """Return the lowest suffix whose digest with key satisfies the difficulty
+    spec, resuming from the cache file and checkpointing it every 'every'
+    suffixes searched."""
+    store: MiningCache = MiningCache(cache)
+    if (answer := store.answer(key, spec)) is not None: return answer
+
+    pred: DigestPredicate = compile_difficulty(spec)
+    start: int = store.resume_at(key, spec)
+    while (answer := find_digest_suffix(key, pred, start, start + every)) is None:
+        start += every
+        store.record(key, spec, checkpoint=start)
+
+    store.record(key, spec, answer=answer)
+    return answer
+
+@dataclass
+class MiningReport:
+    suffix: int | None
+    hashes: int # hashes computed, including those past suffix
+    seconds: float
+
+    @property
+    def hashes_per_second(self) -> float:
+        return self.hashes / self.seconds if self.seconds else 0.0
+
+def mine_range(key: str, pred: Callable, start: int, stop: int) -> tuple[int | None, int]:
+    """Return the lowest suffix in [start, stop) that satisfies pred like
+    get_hash_key_num_suffix does (or None), and how many hashes it took. A
+    DigestPredicate runs through find_digest_suffix."""
+    if isinstance(pred, DigestPredicate):
+        suffix: int | None = find_digest_suffix(key, pred, start, stop)
+        return (suffix, stop - start if suffix is None else suffix - start + 1)
+
+    for suffix in range(start, stop):
+        if pred(hashlib.md5((key + str(suffix)).encode()).hexdigest()):
+            return (suffix, suffix - start + 1)
+
+    return (None, stop - start)
+
+def mine(key: str, pred: Callable, workers: int | None = None,
+         batch: int = BATCH_SIZE) -> MiningReport:
+    """Parallel get_hash_key_num_suffix: hand out ranges of batch suffixes in
+    order to a pool of workers. Once there's a hit, ranges above it are
+    dropped but the lower ones still running are waited for, so the lowest
+    suffix is returned."""
+    workers = workers or os.cpu_count() or 1
+    began: float = time.perf_counter()
+    pending: dict[Future, int] = {} # range start of every running batch
+    next_start: int = 0
+    hashes: int = 0
+    best: int | None = None
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while best is None and len(pending) < 2 * workers:
+                f = pool.submit(mine_range, key, pred, next_start, next_start + batch)
+                pending[f] = next_start
+                next_start += batch
+            if not pending: break
+
+            done, __ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                del pending[f]
+                hit, n = f.result()
+                hashes += n
+                if hit is not None and (best is None or hit < best):
+                    best = hit
+
+            if best is not None:
+                for f in [f for f, start in pending.items() if start > best]:
+                    f.cancel()
+                    del pending[f]
+
+        pool.shutdown(cancel_futures=True)
+
+    return MiningReport(best, hashes, time.perf_counter() - began)
+
+@dataclass
+class MiningJob:
+    key: str
+    spec: str # difficulty spec, see compile_difficulty
+    deadline: float | None = None # seconds after the batch starts
+
+def mine_batch(jobs: list[MiningJob], workers: int | None = None,
+               batch: int = BATCH_SIZE) -> Iterator[tuple[MiningJob, MiningReport]]:
+    """Mine every job on one shared pool of workers, yielding each job with
+    its MiningReport as soon as it is done (suffix is None if its deadline
+    passed first).
+
+    Whenever a worker is free it takes the next range of the open job with
+    the earliest deadline, or else the one with the fewest ranges handed out,
+    so long jobs soak up the cores left by short ones. Once a job has a hit,
+    its ranges above it are dropped as in mine."""
+    workers = workers or os.cpu_count() or 1
+    began: float = time.perf_counter()
+    active: list[dict] = [{'job': j, 'pred': compile_difficulty(j.spec), 'next': 0,
+                           'ranges': 0, 'hashes': 0, 'best': None} for j in jobs]
+    pending: dict[Future, tuple[dict, int]] = {} # job state and range start
+
+    def priority(state: dict) -> tuple[float, int]:
+        deadline: float | None = state['job'].deadline
+        return (float('inf') if deadline is None else deadline, state['ranges'])
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while active:
+            while len(pending) < 2 * workers:
+                open_jobs: list[dict] = [s for s in active if s['best'] is None]
+                if not open_jobs: break
+                state: dict = min(open_jobs, key=priority)
+                f = pool.submit(mine_range, state['job'].key, state['pred'],
+                                state['next'], state['next'] + batch)
+                pending[f] = (state, state['next'])
+                state['next'] += batch
+                state['ranges'] += 1
+
+            deadlines: list[float] = [s['job'].deadline for s in active
+                                      if s['job'].deadline is not None]
+            timeout: float | None = None
+            if deadlines:
+                timeout = max(0.0, min(deadlines) - (time.perf_counter() - began))
+            done, __ = wait(pending, timeout, return_when=FIRST_COMPLETED)
+
+            for f in done:
+                state, start = pending.pop(f)
+                hit, n = f.result()
+                state['hashes'] += n
+                if hit is not None and (state['best'] is None or hit < state['best']):
+                    state['best'] = hit
+
+            for f in [f for f, (s, start) in pending.items()
+                      if s['best'] is not None and start > s['best']]:
+                f.cancel()
+                del pending[f]
+
+            elapsed: float = time.perf_counter() - began
+            for state in list(active):
+                job: MiningJob = state['job']
+                ranges: list[Future] = [f for f, (s, start) in pending.items() if s is state]
+                expired: bool = job.deadline is not None and elapsed >= job.deadline
+                if state['best'] is not None and not ranges:
+                    report = MiningReport(state['best'], state['hashes'], elapsed)
+                elif expired:
+                    report = MiningReport(None, state['hashes'], elapsed)
+                else:
+                    continue
+
+                for f in ranges:
+                    f.cancel()
+                    del pending[f]
+                active.remove(state)
+                yield (job, report)
+
+        pool.shutdown(cancel_futures=True)
+
+def write_atomically(path: str, content) -> None:
+    "Dump content as JSON to path through a temporary file."
+    tmp: str = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmp, path)
+
+def create_queue(directory: str, key: str, spec: str, batch: int = BATCH_SIZE) -> None:
+    """Set up directory as the shared work queue of a search, split in ranges
+    of batch suffixes that workers lease ('<start>.lease' files) and mark as
+    searched ('<start>.done' files holding the hit or null)."""
+    settings: dict = {'key': key, 'spec': spec, 'batch': batch}
+    path: str = os.path.join(directory, 'queue.json')
+    os.makedirs(directory, exist_ok=True)
+    if not os.path.exists(path):
+        write_atomically(path, settings)
+    with open(path) as f:
+        queue: dict = json.load(f)
+    if queue != settings:
+        raise ValueError(f"Queue in '{directory}' is set up for another search: {queue}")
+
+def queue_state(directory: str) -> tuple[dict, dict[int, int | None]]:
+    "Return the queue settings and the hit (or None) of every searched range."
+    with open(os.path.join(directory, 'queue.json')) as f:
+        queue: dict = json.load(f)
+    done: dict[int, int | None] = {}
+    for name in os.listdir(directory):
+        start, __, kind = name.partition('.')
+        if kind == 'done':
+            with open(os.path.join(directory, name)) as f:
+                done[int(start)] = json.load(f)
+
+    return (queue, done)
+
+def queue_answer(directory: str) -> int | None:
+    """Return the lowest hit of the queue, once every range below it has been
+    searched; None until then."""
+    queue, done = queue_state(directory)
+    hits: list[int] = [h for h in done.values() if h is not None]
+    if not hits: return None
+    best: int = min(hits)
+    if all(start in done for start in range(0, best, queue['batch'])):
+        return best
+
+    return None
+
+def claim_range(directory: str, start: int, worker: str, lease: float) -> bool:
+    """Lease the range of the queue starting at start to worker for lease
+    seconds; return False if someone else holds a lease that hasn't expired.
+    Leases are written aside and linked into place, so they are never seen
+    half written; one left empty by an older crash expires lease seconds after
+    its last change. Expired leases are renamed away and compared with what
+    was read before being removed, so a fresh lease another worker put in
+    their place meanwhile is linked back instead."""
+    path: str = os.path.join(directory, f"{start}.lease")
+    try:
+        with open(path, 'rb') as f:
+            held: bytes | None = f.read()
+            changed: float = os.fstat(f.fileno()).st_mtime
+    except FileNotFoundError:
+        held = None
+
+    if held is not None:
+        try:
+            expires: float = json.loads(held)['expires']
+        except (ValueError, KeyError):
+            expires = changed + lease
+        if expires > time.time(): return False
+        expired: str = f"{path}.{worker}.expired"
+        try:
+            os.rename(path, expired)
+        except FileNotFoundError:
+            return False
+        with open(expired, 'rb') as f:
+            stale: bool = f.read() == held
+        if not stale:
+            try:
+                os.link(expired, path)
+            except FileExistsError:
+                pass
+        os.remove(expired)
+        if not stale: return False
+
+    tmp: str = f"{path}.{worker}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'worker': worker, 'expires': time.time() + lease}, f)
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
+
+    return True
+
+def release_range(directory: str, start: int, worker: str) -> None:
+    """Remove the lease of the range starting at start, unless it expired
+    and is gone or was reclaimed by another worker meanwhile."""
+    path: str = os.path.join(directory, f"{start}.lease")
+    try:
+        with open(path) as f:
+            holder: str = json.load(f)['worker']
+        if holder == worker:
+            os.remove(path)
+    except (FileNotFoundError, ValueError):
+        pass
+
+def queue_worker(directory: str, worker: str | None = None,
+                 lease: float = QUEUE_LEASE) -> int:
+    """Search the lowest unsearched, unleased ranges of the queue in directory
+    until its answer is known, and return it. Any number of these may run on
+    hosts sharing the directory; ranges of crashed workers are reissued once
+    their lease expires, which must be longer than searching a range takes."""
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    queue, __ = queue_state(directory)
+    pred: DigestPredicate = compile_difficulty(queue['spec'])
+
+    while (answer := queue_answer(directory)) is None:
+        __, done = queue_state(directory)
+        hits: list[int] = [h for h in done.values() if h is not None]
+        start: int = 0
+        while not hits or start < min(hits):
+            if start not in done and claim_range(directory, start, worker, lease):
+                break
+            start += queue['batch']
+        else: # every range below the lowest hit is searched or leased
+            time.sleep(QUEUE_POLL)
+            continue
+
+        hit, __ = mine_range(queue['key'], pred, start, start + queue['batch'])
+        write_atomically(os.path.join(directory, f"{start}.done"), hit)
+        release_range(directory, start, worker)
+
+    return answer
+
+def distributed_mine(directory: str, key: str, spec: str, processes: int | None = None,
+                     batch: int = BATCH_SIZE, lease: float = QUEUE_LEASE) -> int:
+    "Run a queue of the search in directory with local worker processes."
+    create_queue(directory, key, spec, batch)
+    workers = [multiprocessing.Process(target=queue_worker, args=(directory, None, lease))
+               for __ in range(processes or os.cpu_count() or 1)]
+    for w in workers: w.start()
+    for w in workers: w.join()
+
+    return queue_answer(directory)
+
 def solve1(key: str = PUZZLE_KEY) -> int:
-    return  get_hash_key_num_suffix(key, starts_with_five_zeroes)
+    return  find_digest_suffix(key, FIVE_ZEROES)
 
 def solve2(key: str = PUZZLE_KEY) -> int:
-    return  get_hash_key_num_suffix(key, starts_with_six_zeroes)
+    return  find_digest_suffix(key, SIX_ZEROES)
 
 ### TEST
 
@@ -82,3 +522,127 @@ def test_solve1():
 
 def test_solve2():
     assert solve2(PUZZLE_KEY) == 9962624
+
+def test_mine_range():
+    assert mine_range('abcdef', starts_with_five_zeroes, 609000, 609100) == (609043, 44)
+    assert mine_range('abcdef', starts_with_five_zeroes, 0, 100) == (None, 100)
+
+def test_mine():
+    report = mine('abcdef', starts_with_five_zeroes, workers=2, batch=10000)
+    assert report.suffix == 609043
+    assert report.hashes >= 609044
+    assert report.hashes_per_second > 0
+    assert mine('pqrstuv', starts_with_five_zeroes, batch=99991).suffix == 1048970
+
+def test_compile_difficulty():
+    assert compile_difficulty('nibbles:5') == DigestPredicate(b'\0\0', 0xf0, 0)
+    assert compile_difficulty('nibbles:6') == DigestPredicate(b'\0\0\0', 0, 0)
+    assert compile_difficulty('bits:9') == DigestPredicate(b'\0', 0x80, 0)
+    assert compile_difficulty('prefix:0abc') == DigestPredicate(b'\x0a\xbc', 0, 0)
+    assert compile_difficulty('prefix:abc') == DigestPredicate(b'\xab', 0xf0, 0xc0)
+    assert compile_difficulty('prefix:') == DigestPredicate(b'', 0, 0)
+    assert compile_difficulty('nibbles:5')(bytes.fromhex('00000a' + '00' * 13))
+    assert not compile_difficulty('nibbles:5')(bytes.fromhex('0000a0' + '00' * 13))
+    assert compile_difficulty('prefix:0abc')(bytes.fromhex('0abcff' + '00' * 13))
+    assert not compile_difficulty('prefix:0abc')(bytes.fromhex('0abdff' + '00' * 13))
+
+def test_find_digest_suffix():
+    assert find_digest_suffix('abcdef', FIVE_ZEROES) == get_hash_key_num_suffix('abcdef', starts_with_five_zeroes)
+    assert find_digest_suffix('abcdef', FIVE_ZEROES, 99, 100000) is None
+    assert find_digest_suffix('abcdef', FIVE_ZEROES, 609043, 609044) == 609043
+    assert find_digest_suffix('abcdef', FIVE_ZEROES, 609000, 609043) is None
+    for spec, pred in (('bits:8', lambda h: int(h[:2], 16) == 0),
+                       ('bits:11', lambda h: int(h[:3], 16) < 2),
+                       ('prefix:abc', lambda h: h.startswith('abc'))):
+        for start in (0, 9, 95, 998):
+            assert find_digest_suffix('abcdef', compile_difficulty(spec), start) == \
+                start + mine_range('abcdef', pred, start, start + 10 ** 6)[1] - 1
+
+    # Ranges shorter than a hundred, inside and across whole hundreds
+    bits3 = compile_difficulty('bits:3')
+    hex3 = lambda h: int(h[0], 16) < 2
+    for start, stop in ((0, 2), (105, 106), (95, 105), (199, 201), (1000, 1001), (7, 7)):
+        hits = [s for s in range(start, stop)
+                if hex3(hashlib.md5(f'abcdef{s}'.encode()).hexdigest())]
+        assert find_digest_suffix('abcdef', bits3, start, stop) == (hits[0] if hits else None)
+
+def test_digest_predicate_implies():
+    assert SIX_ZEROES.implies(FIVE_ZEROES)
+    assert not FIVE_ZEROES.implies(SIX_ZEROES)
+    assert compile_difficulty('bits:21').implies(FIVE_ZEROES)
+    assert compile_difficulty('prefix:00000a').implies(compile_difficulty('bits:20'))
+    assert not compile_difficulty('prefix:000010').implies(compile_difficulty('bits:20'))
+    assert compile_difficulty('prefix:abc').prefix() == (12, 0xabc)
+
+def test_cached_mine(tmp_path):
+    cache = tmp_path / 'cache.json'
+    assert cached_mine('abcdef', 'nibbles:5', cache, every=100000) == 609043
+    assert MiningCache(cache).records == {'abcdef': {'nibbles:5': {'checkpoint': 600000,
+                                                                   'answer': 609043}}}
+    assert cached_mine('abcdef', 'nibbles:5', cache) == 609043
+    assert MiningCache(cache).resume_at('abcdef', 'bits:21') == 609043
+    assert MiningCache(cache).resume_at('abcdef', 'bits:19') == 0
+
+    # Searches resume from the checkpoint
+    store = MiningCache(cache)
+    store.record('pqrstuv', 'nibbles:5', checkpoint=1048971)
+    assert cached_mine('pqrstuv', 'nibbles:5', cache) > 1048970
+
+def test_mine_batch():
+    jobs = [MiningJob('pqrstuv', 'nibbles:5'), MiningJob('abcdef', 'nibbles:5'),
+            MiningJob('abcdef', 'bits:8'), MiningJob('abcdef', 'nibbles:7', deadline=0.5)]
+    results = list(mine_batch(jobs, workers=2, batch=20000))
+    assert results[0][0] == jobs[3] # earliest deadline goes first
+    suffixes = {(j.key, j.spec): r.suffix for j, r in results}
+    assert suffixes == {('pqrstuv', 'nibbles:5'): 1048970,
+                        ('abcdef', 'nibbles:5'): 609043,
+                        ('abcdef', 'bits:8'): find_digest_suffix('abcdef', compile_difficulty('bits:8')),
+                        ('abcdef', 'nibbles:7'): None}
+
+def test_distributed_mine(tmp_path):
+    assert distributed_mine(tmp_path / 'a', 'abcdef', 'nibbles:5', 3, batch=50000) == 609043
+    assert queue_answer(tmp_path / 'a') == 609043
+
+    # A crashed worker's range is reissued once its lease expires
+    create_queue(tmp_path / 'b', 'abcdef', 'nibbles:5', batch=100000)
+    with open(tmp_path / 'b' / '600000.lease', 'w') as f:
+        json.dump({'worker': 'crashed', 'expires': time.time() + 1}, f)
+    assert not claim_range(tmp_path / 'b', 600000, 'other', 10)
+    assert distributed_mine(tmp_path / 'b', 'abcdef', 'nibbles:5', 2, batch=100000) == 609043
+    assert not any(name.endswith('lease') for name in os.listdir(tmp_path / 'b'))
+    with pytest.raises(ValueError):
+        create_queue(tmp_path / 'b', 'abcdef', 'nibbles:6', batch=100000)
+
+def test_release_range(tmp_path):
+    create_queue(tmp_path, 'abcdef', 'nibbles:5')
+    release_range(tmp_path, 0, 'me') # expired and gone already
+    assert claim_range(tmp_path, 0, 'other', 10)
+    release_range(tmp_path, 0, 'me')
+    assert os.path.exists(tmp_path / '0.lease')
+    release_range(tmp_path, 0, 'other')
+    assert not os.path.exists(tmp_path / '0.lease')
+
+def test_claim_range(tmp_path, monkeypatch):
+    create_queue(tmp_path, 'abcdef', 'nibbles:5')
+    assert claim_range(tmp_path, 0, 'me', -1) # expires right away
+    assert claim_range(tmp_path, 0, 'other', 10)
+    assert not claim_range(tmp_path, 0, 'me', 10)
+
+    # A lease left empty by a crash expires after lease seconds
+    (tmp_path / '100.lease').write_text('')
+    assert not claim_range(tmp_path, 100, 'me', 10)
+    os.utime(tmp_path / '100.lease', (time.time() - 20, time.time() - 20))
+    assert claim_range(tmp_path, 100, 'me', 10)
+
+    # Another worker reclaims the expired lease first: its lease is kept
+    assert claim_range(tmp_path, 200, 'crashed', -1)
+    rename = os.rename
+    def reclaimed_meanwhile(src, dst):
+        monkeypatch.setattr(os, 'rename', rename)
+        assert claim_range(tmp_path, 200, 'faster', 10)
+        rename(src, dst)
+    monkeypatch.setattr(os, 'rename', reclaimed_meanwhile)
+    assert not claim_range(tmp_path, 200, 'slower', 10)
+    with open(tmp_path / '200.lease') as f:
+        assert json.load(f)['worker'] == 'faster'
+    assert sorted(os.listdir(tmp_path)) == ['0.lease', '100.lease', '200.lease', 'queue.json']
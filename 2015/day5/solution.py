@@ -68,13 +68,37 @@
 # How many strings are nice under these new rules?
 
 import pytest
+from typing import Callable, Iterable
+from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import os
 import re
 import io
+import time
 
 TEST1_FILE: str = "./test1"
 TEST2_FILE: str = "./test2"
 PUZZLE_FILE: str = "./puzzle"
 FORBIDDEN_STRINGS: list[str] = ["ab", "cd", "pq", "xy"]
+FORBIDDEN_PAIRS: frozenset[str] = frozenset(FORBIDDEN_STRINGS) # all are pairs
+VOWELS: frozenset[str] = frozenset('aeiou')
+REORDER_EVERY: int = 1000 # words a RuleEngine checks between rule reorderings
+WORD_WIDTH: int = 16 # letters per word of the fixed-width batch path
+SHARD_BYTES: int = 1 << 26 # bytes of word list classified per batch task
+CLASSIFY_BLOCK: int = 1 << 16 # fixed-width words classified as one matrix
+VOWEL_TABLE: np.ndarray = np.zeros(256, dtype=np.uint8)
+VOWEL_TABLE[[ord(v) for v in VOWELS]] = 1
+FORBIDDEN_CODES: np.ndarray = np.array([ord(a) << 8 | ord(b) for a, b in FORBIDDEN_PAIRS],
+                                       dtype=np.uint16)
+
+# Rule sets as data, see compile_rule for every rule kind and its arguments.
+NICE_RULES: list[dict] = [{'kind': 'vowels', 'min': 3, 'letters': 'aeiou'},
+                          {'kind': 'run', 'length': 2},
+                          {'kind': 'forbidden', 'substrings': FORBIDDEN_STRINGS}]
+VERY_NICE_RULES: list[dict] = [{'kind': 'separated_pair'},
+                               {'kind': 'repeated_pair'}]
 
 def contains_three_vowels(s: str) -> bool:
     m = re.match(r'^.*([aeiou]{1}).*([aeiou]{1}).*([aeiou]{1})', s)
@@ -120,14 +144,42 @@ def contains_repeated_pair(s: str) -> bool:
     twice in the string without overlapping, like xyxy (xy) or aabcdefgaa (aa),
     but not like aaa (aa, but it overlaps).
     """
-    for pos in range(1, len(s) - 1):
-        pair: str = s[pos - 1 : pos + 1]
-        ss: str = s[pos + 1 :]
-        if pair in ss:
+    first_at: dict[str, int] = {} # position of the first occurrence of each pair
+    for pos in range(1, len(s)):
+        if pos - first_at.setdefault(s[pos - 1 : pos + 1], pos) >= 2:
             return True
     else:
         return False
 
+class RepeatedPairScanner:
+    """contains_repeated_pair for strings fed in chunks: only the last
+    character, the position and the first position of every pair seen are
+    kept between chunks."""
+
+    def __init__(self):
+        self.first_at: dict[str, int] = {}
+        self.pos: int = 0
+        self.last: str = ''
+        self.found: bool = False
+
+    def feed(self, chunk: str) -> bool:
+        "Scan the next chunk; return True once a repeated pair was found."
+        for ch in chunk:
+            if self.found: break
+            if self.pos:
+                pair: str = self.last + ch
+                if self.pos - self.first_at.setdefault(pair, self.pos) >= 2:
+                    self.found = True
+            self.last = ch
+            self.pos += 1
+
+        return self.found
+
+def stream_contains_repeated_pair(chunks: Iterable[str]) -> bool:
+    "Return contains_repeated_pair of the string made of chunks."
+    scanner: RepeatedPairScanner = RepeatedPairScanner()
+    return any(scanner.feed(c) for c in chunks)
+
 def contains_separated_pair(s: str) -> bool:
     """Return True if s contains at least one letter which repeats with exactly
     one letter between them, like xyx, abcdefeghi (efe), or even aaa.
@@ -162,6 +214,258 @@ def solve2(puzzle: str) -> int:
         lines: list[str] = p.readlines()
         return len([l for l in lines if is_very_nice(l)])
 
+def classify(s: str) -> tuple[bool, bool]:
+    """Return whether s is nice and whether it is very nice, computing vowel
+    count, double letter, forbidden pair, repeated pair and separated pair in
+    a single walk over s."""
+    vowels: int = 0
+    double: bool = False
+    forbidden: bool = False
+    repeated: bool = False
+    separated: bool = False
+    first_at: dict[str, int] = {} # position of the first occurrence of each pair
+    before: str = ''
+    prev: str = ''
+
+    for pos, ch in enumerate(s):
+        if ch in VOWELS: vowels += 1
+        if ch == prev: double = True
+        if ch == before: separated = True
+        if pos:
+            pair: str = prev + ch
+            if pair in FORBIDDEN_PAIRS: forbidden = True
+            if pos - first_at.setdefault(pair, pos) >= 2: repeated = True
+        before, prev = prev, ch
+
+    return (vowels >= 3 and double and not forbidden, repeated and separated)
+
+def solve_both(puzzle: str) -> tuple[int, int]:
+    "Return the answers of solve1 and solve2 with a single pass over puzzle."
+    nice: int = 0
+    very_nice: int = 0
+    with open(puzzle, 'r', encoding='utf-8') as p:
+        for l in p:
+            part1, part2 = classify(l)
+            nice += part1
+            very_nice += part2
+
+    return (nice, very_nice)
+
+class AhoCorasick:
+    "Automaton that finds whether a string contains any of a set of substrings."
+
+    def __init__(self, substrings: Iterable[str]):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.match: list[bool] = [False]
+        for ss in substrings:
+            state: int = 0
+            for ch in ss:
+                if ch not in self.goto[state]:
+                    self.goto[state][ch] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.match.append(False)
+                state = self.goto[state][ch]
+            self.match[state] = True
+
+        # Breadth first, so the failure state of every parent is already set
+        queue: deque[int] = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                fail: int = self.fail[state]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(ch, 0)
+                self.match[child] = self.match[child] or self.match[self.fail[child]]
+                queue.append(child)
+
+    def search(self, string: str) -> bool:
+        "Return True if string contains any of the substrings."
+        if self.match[0]: return True
+        state: int = 0
+        for ch in string:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if self.match[state]: return True
+
+        return False
+
+def contains_run(s: str, length: int) -> bool:
+    "Return True if a letter appears length times in a row in s."
+    run: int = 0
+    past_ch: str = ''
+    for ch in s:
+        run = run + 1 if ch == past_ch else 1
+        if run >= length: return True
+        past_ch = ch
+
+    return length <= 0
+
+@dataclass
+class Rule:
+    name: str
+    check: Callable[[str], bool] # True if the string passes the rule
+    calls: int = 0
+    rejections: int = 0
+    seconds: float = 0.0
+
+    def cost(self) -> float:
+        "Seconds spent per rejection; the lower, the earlier the rule should run."
+        return self.seconds / self.rejections if self.rejections else float('inf')
+
+def compile_rule(rule: dict) -> Rule:
+    """Compile a rule declared as a dict with a 'kind' (and optionally a
+    'name') into a Rule. Kinds are 'vowels' (at least 'min' of 'letters'),
+    'run' (a letter 'length' times in a row), 'forbidden' (none of
+    'substrings'), 'repeated_pair' and 'separated_pair'."""
+    name: str = rule.get('name', rule['kind'])
+    match rule['kind']:
+        case 'vowels':
+            letters: frozenset[str] = frozenset(rule.get('letters', 'aeiou'))
+            return Rule(name, lambda s: sum(ch in letters for ch in s) >= rule['min'])
+        case 'run':
+            return Rule(name, lambda s: contains_run(s, rule['length']))
+        case 'forbidden':
+            automaton: AhoCorasick = AhoCorasick(rule['substrings'])
+            return Rule(name, lambda s: not automaton.search(s))
+        case 'repeated_pair':
+            return Rule(name, contains_repeated_pair)
+        case 'separated_pair':
+            return Rule(name, contains_separated_pair)
+        case _:
+            raise ValueError("'kind' of rule not valid: {}".format(rule['kind']))
+
+class RuleEngine:
+    """Checks strings against a compiled rule set, keeping per-rule rejection
+    statistics and, every reorder_every strings, sorting the rules so that
+    the cheapest and most selective ones run first."""
+
+    def __init__(self, rules: list[dict], reorder_every: int = REORDER_EVERY):
+        self.rules: list[Rule] = [compile_rule(r) for r in rules]
+        self.reorder_every = reorder_every
+        self.checked: int = 0
+
+    def __call__(self, s: str) -> bool:
+        "Return True if s passes every rule."
+        self.checked += 1
+        if self.checked % self.reorder_every == 0:
+            self.rules.sort(key=Rule.cost)
+
+        for rule in self.rules:
+            began: float = time.perf_counter()
+            passed: bool = rule.check(s)
+            rule.seconds += time.perf_counter() - began
+            rule.calls += 1
+            if not passed:
+                rule.rejections += 1
+                return False
+
+        return True
+
+    def stats(self) -> list[dict]:
+        "Return the calls, rejections and time spent of every rule, in order."
+        return [{'name': r.name, 'calls': r.calls, 'rejections': r.rejections,
+                 'seconds': r.seconds} for r in self.rules]
+
+def solve_rules(puzzle: str, rules: list[dict]) -> int:
+    "Count the lines of puzzle that pass every rule of the rule set."
+    engine: RuleEngine = RuleEngine(rules)
+    with open(puzzle, 'r', encoding='utf-8') as p:
+        return sum(engine(l) for l in p)
+
+def classify_matrix(words: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return which rows of an (N, width) uint8 matrix of words are nice and
+    which are very nice, evaluating every rule on the whole matrix at once."""
+    pairs: np.ndarray = (words[:, :-1].astype(np.uint16) << 8) | words[:, 1:]
+    vowels: np.ndarray = VOWEL_TABLE[words].sum(axis=1, dtype=np.int64) >= 3
+    double: np.ndarray = (words[:, 1:] == words[:, :-1]).any(axis=1)
+    forbidden: np.ndarray = np.isin(pairs, FORBIDDEN_CODES).any(axis=1)
+    separated: np.ndarray = (words[:, 2:] == words[:, :-2]).any(axis=1)
+    repeated: np.ndarray = np.zeros(len(words), dtype=bool)
+    for gap in range(2, pairs.shape[1]): # pairs two or more letters apart
+        repeated |= (pairs[:, :-gap] == pairs[:, gap:]).any(axis=1)
+
+    return (vowels & double & ~forbidden, repeated & separated)
+
+def word_matrix(buf: np.ndarray, starts: np.ndarray, width: int) -> np.ndarray:
+    """Return the (N, width) uint8 matrix of the words of buf at starts. Words
+    one newline apart are a strided view of buf, others get copied."""
+    count: int = len(starts)
+    first: int = int(starts[0])
+    end: int = first + count * (width + 1)
+    if int(starts[-1]) - first == (count - 1) * (width + 1) and end <= len(buf):
+        return buf[first:end].reshape(count, width + 1)[:, :width]
+
+    return buf[starts[:, None] + np.arange(width)]
+
+def classify_buffer(data: bytes, width: int = WORD_WIDTH) -> tuple[int, int]:
+    """Count the nice and very nice lines of data. Lines width letters long
+    go through classify_matrix, CLASSIFY_BLOCK of them at a time to bound the
+    memory used, any other through classify."""
+    buf: np.ndarray = np.frombuffer(data, dtype=np.uint8)
+    ends: np.ndarray = np.flatnonzero(buf == ord('\n'))
+    if not data.endswith(b'\n'): ends = np.r_[ends, len(buf)]
+    starts: np.ndarray = np.r_[0, ends[:-1] + 1][: len(ends)]
+    fixed: np.ndarray = ends - starts == width
+
+    nice: int = 0
+    very_nice: int = 0
+    fixed_starts: np.ndarray = starts[fixed]
+    for block in range(0, len(fixed_starts), CLASSIFY_BLOCK):
+        words: np.ndarray = word_matrix(buf, fixed_starts[block : block + CLASSIFY_BLOCK], width)
+        part1, part2 = classify_matrix(words)
+        nice += int(part1.sum())
+        very_nice += int(part2.sum())
+    for start, end in zip(starts[~fixed].tolist(), ends[~fixed].tolist()):
+        part1, part2 = classify(data[start:end].decode())
+        nice += part1
+        very_nice += part2
+
+    return (nice, very_nice)
+
+def shard_offsets(puzzle: str, shards: int) -> list[tuple[int, int]]:
+    "Split puzzle in up to shards (start, end) byte ranges aligned to lines."
+    size: int = os.path.getsize(puzzle)
+    bounds: list[int] = [0]
+    with open(puzzle, 'rb') as p:
+        for i in range(1, shards):
+            pos: int = max(size * i // shards, bounds[-1])
+            if pos > 0:
+                # Move to the start of the line following byte pos - 1
+                p.seek(pos - 1)
+                p.readline()
+                pos = min(p.tell(), size)
+            bounds.append(pos)
+    bounds.append(size)
+
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+def classify_shard(puzzle: str, start: int, end: int) -> tuple[int, int]:
+    "Count the nice and very nice lines between byte offsets start and end."
+    with open(puzzle, 'rb') as p:
+        p.seek(start)
+        return classify_buffer(p.read(end - start))
+
+def batch_solve(puzzle: str, workers: int | None = None,
+                shard_bytes: int = SHARD_BYTES) -> tuple[int, int]:
+    """Return the answers of solve1 and solve2, classifying shards of about
+    shard_bytes of the word list as matrices on a pool of workers."""
+    workers = workers or os.cpu_count() or 1
+    shards: list[tuple[int, int]] = shard_offsets(
+        puzzle, max(workers, -(-os.path.getsize(puzzle) // shard_bytes)))
+    nice: int = 0
+    very_nice: int = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part1, part2 in pool.map(classify_shard, [puzzle] * len(shards),
+                                     *zip(*shards)):
+            nice += part1
+            very_nice += part2
+
+    return (nice, very_nice)
+
 ### TEST
 
 # test1 file content:
@@ -219,3 +523,94 @@ def test_solve2():
     assert solve2(TEST2_FILE) == 2
     assert solve2(PUZZLE_FILE) == 51
 
+def test_classify():
+    assert classify('ugknbfddgicrmopn') == (True, False)
+    assert classify('aaa') == (True, False)
+    assert classify('haegwjzuvuyypxyu') == (False, False)
+    assert classify('qjhvhtzxzqqjkmpb') == (False, True)
+    assert classify('xxyxx') == (False, True)
+    assert classify('ieodomkazucvgmuy') == (False, False)
+    assert classify('aaaa') == (True, True)
+    assert classify('') == (False, False)
+    with open(PUZZLE_FILE) as p:
+        for l in p:
+            assert classify(l) == (is_nice(l), is_very_nice(l))
+
+def test_solve_both():
+    assert solve_both(TEST1_FILE)[0] == 1
+    assert solve_both(TEST2_FILE)[1] == 2
+    assert solve_both(PUZZLE_FILE) == (236, 51)
+
+def test_stream_contains_repeated_pair():
+    for s in ('xyxy', 'aabcdefgaa', 'fasfkkhkkff', 'aaa', 'aaaa', 'abcab', 'a', ''):
+        for size in (1, 2, 3):
+            chunks = [s[i : i + size] for i in range(0, len(s), size)]
+            assert stream_contains_repeated_pair(chunks) == contains_repeated_pair(s)
+    assert not contains_repeated_pair('abcdefghijklmnopqrstuvwxyz')
+    assert stream_contains_repeated_pair(iter(['x', 'yzx', 'y']))
+    assert not stream_contains_repeated_pair(iter(['x', 'xx']))
+
+def test_aho_corasick():
+    automaton = AhoCorasick(FORBIDDEN_STRINGS + ['bcd', 'xyz'])
+    assert automaton.search('haegwjzuvuyypxyu')
+    assert automaton.search('zzbcz') is False
+    assert automaton.search('zzbcdz')
+    assert not automaton.search('ugknbfddgicrmopn')
+    assert AhoCorasick(['he', 'she', 'his', 'hers']).search('ushers')
+    assert not AhoCorasick([]).search('abc')
+    assert AhoCorasick(['']).search('')
+
+def test_contains_run():
+    assert contains_run('abba', 2)
+    assert not contains_run('abba', 3)
+    assert contains_run('abbba', 3)
+    assert not contains_run('', 1)
+
+def test_rule_engine():
+    nice = RuleEngine(NICE_RULES, reorder_every=10)
+    very_nice = RuleEngine(VERY_NICE_RULES, reorder_every=10)
+    with open(PUZZLE_FILE) as p:
+        for l in p:
+            assert nice(l) == is_nice(l)
+            assert very_nice(l) == is_very_nice(l)
+    assert sum(r['calls'] for r in nice.stats()) >= 1000
+    assert nice.stats()[0]['name'] != 'forbidden' # rejects the fewest
+
+    engine = RuleEngine([{'kind': 'vowels', 'min': 0},
+                         {'kind': 'vowels', 'min': 99, 'name': 'never'}], reorder_every=2)
+    assert not engine('abc')
+    assert not engine('abc')
+    assert [r['name'] for r in engine.stats()] == ['never', 'vowels']
+    with pytest.raises(ValueError):
+        RuleEngine([{'kind': 'unknown'}])
+
+def test_solve_rules():
+    assert solve_rules(PUZZLE_FILE, NICE_RULES) == 236
+    assert solve_rules(PUZZLE_FILE, VERY_NICE_RULES) == 51
+    assert solve_rules(TEST1_FILE, NICE_RULES + [{'kind': 'forbidden', 'substrings': ['dm']}]) == 0
+
+def test_classify_matrix():
+    words = np.frombuffer(b'ugknbfddgicrmopnqjhvhtzxzqqjkmpbaaaaaaaaaaaaaaaa',
+                          dtype=np.uint8).reshape(-1, 16)
+    nice, very_nice = classify_matrix(words)
+    assert nice.tolist() == [True, False, True]
+    assert very_nice.tolist() == [False, True, True]
+
+def test_classify_buffer():
+    assert classify_buffer(b'') == (0, 0)
+    assert classify_buffer(b'xxyxx\nugknbfddgicrmopn') == (1, 1)
+    assert classify_buffer(b'aaa\n\nqjhvhtzxzqqjkmpb\n') == (1, 1)
+    with open(PUZZLE_FILE, 'rb') as p:
+        assert classify_buffer(p.read()) == (236, 51)
+
+def test_word_matrix():
+    buf = np.frombuffer(b'abc\ndef\nxy\nghi', dtype=np.uint8)
+    words = word_matrix(buf, np.array([0, 4]), 3)
+    assert np.shares_memory(words, buf) and words.tobytes() == b'abcdef'
+    assert word_matrix(buf, np.array([0, 4, 11]), 3).tobytes() == b'abcdefghi'
+    assert word_matrix(buf, np.array([11]), 3).tobytes() == b'ghi'
+
+def test_batch_solve():
+    assert batch_solve(PUZZLE_FILE, workers=2, shard_bytes=1000) == (236, 51)
+    assert batch_solve(TEST1_FILE)[0] == 1
+    assert batch_solve(TEST2_FILE)[1] == 2
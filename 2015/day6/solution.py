@@ -104,20 +104,21 @@
 import pytest
 from typing import NewType
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
 import re
+import zlib
 
 
 Point = namedtuple('Point', ['x', 'y'])
-Grid = list[list[int]]
+Instruction = dict # as returned by parse_instruction
 
 PUZZLE_FILE: str = './puzzle'
 TEST_FILE: str = './test'
-
-
-def make_grid(n: int = 1000) -> Grid:
-    "Return a Grid of n by n dimensions with all values initialized as zeroes."
-    val: int = 0 # ON value on grid
-    return [list([val] * n) for __ in range(n)]
+POPCOUNT_CHUNK: int = 1 << 20 # bytes of a BitGrid counted at a time
+SNAPSHOT_EVERY: int = 50 # instructions between InstructionReplay snapshots
+TILE_SIZE: int = 250 # side of the grid tiles handed to parallel_total workers
 
 
 def parse_instruction(s: str) -> dict:
@@ -136,129 +137,409 @@ def parse_instruction(s: str) -> dict:
     return {'action' : action, 'p1' : p1, 'p2' : p2}
 
 
-def make_rectangle(p1: Point, p2: Point) -> list[Point]:
-    """Return a list of the Points ocurring inside a given rectangle defined by
-    the two corners (inclusive) given as Points (p1 and p2.)"""
-    assert isinstance(p1, Point) and isinstance(p2, Point), "make_rectangle(): p1 and p2 must be Points"
-    x_range = range(min(p1.x, p2.x), max((p1.x, p2.x)) + 1)
-    y_range = range(min(p1.y, p2.y), max((p1.y, p2.y)) + 1)
-
-    return [Point(x_pos, y_pos) for x_pos in x_range for y_pos in y_range]
-
-
-def turn_on(p: Point, g: Grid) -> int:
-    g[p.y][p.x] = 1
-    return None
-
-
-def turn_off(p: Point, g: Grid) -> int:
-    g[p.y][p.x] = 0
-    return None
-
-
-def toggle(p: Point, g: Grid) -> int:
-    "Toggle a given binary value to its other state."
-    if g[p.y][p.x] == 0:
-        turn_on(p, g)
-    else:
-        turn_off(p,g)
+def rectangle_slices(p1: Point, p2: Point) -> tuple[slice, slice]:
+    """Return the (rows, columns) slices of an array grid covering the
+    rectangle of corners p1 and p2 (inclusive)."""
+    return (slice(min(p1.y, p2.y), max(p1.y, p2.y) + 1),
+            slice(min(p1.x, p2.x), max(p1.x, p2.x) + 1))
+
+
+def switch_lights(grid: np.ndarray, i: Instruction) -> None:
+    "Apply a first part instruction to an on/off array grid in place."
+    rect: np.ndarray = grid[rectangle_slices(i['p1'], i['p2'])]
+    match i['action']:
+        case 'turn on':
+            rect[...] = 1
+        case 'turn off':
+            rect[...] = 0
+        case 'toggle':
+            rect ^= 1
+        case _:
+            raise RuntimeError(f"Couldn't understand 'action' in: '{i['action']}'")
+
+
+def adjust_brightness(grid: np.ndarray, i: Instruction) -> None:
+    "Apply a second part instruction to a brightness array grid in place."
+    rect: np.ndarray = grid[rectangle_slices(i['p1'], i['p2'])]
+    match i['action']:
+        case 'turn on':
+            rect += 1
+        case 'turn off':
+            rect -= rect > 0 # never below zero
+        case 'toggle':
+            rect += 2
+        case _:
+            raise RuntimeError(f"Couldn't understand 'action' in: '{i['action']}'")
+
+
+def light_grid(instructions: list[Instruction], n: int = 1000,
+               part_two: bool = False) -> np.ndarray:
+    """Return the n by n array grid (uint8 lights or uint32 brightness) after
+    following instructions; None instructions (blank lines) are skipped."""
+    grid: np.ndarray = np.zeros((n, n), dtype=np.uint32 if part_two else np.uint8)
+    apply = adjust_brightness if part_two else switch_lights
+    for i in instructions:
+        if i: apply(grid, i)
+
+    return grid
+
+
+def compress_instructions(instructions: list[Instruction],
+                          n: int = 1000) -> tuple[list[Instruction], np.ndarray, np.ndarray]:
+    """Compress the coordinates of instructions over an n by n grid to the
+    distinct rectangle edges. Return the instructions over the compressed
+    grid, whose block (i, j) spans columns xs[j] to xs[j + 1] (exclusive) and
+    rows ys[i] to ys[i + 1], and the xs and ys edges."""
+    instructions = [i for i in instructions if i]
+    xs: np.ndarray = np.unique([0, n] + [min(i['p1'].x, i['p2'].x) for i in instructions] +
+                               [max(i['p1'].x, i['p2'].x) + 1 for i in instructions])
+    ys: np.ndarray = np.unique([0, n] + [min(i['p1'].y, i['p2'].y) for i in instructions] +
+                               [max(i['p1'].y, i['p2'].y) + 1 for i in instructions])
+
+    def block(x: int, y: int, end: bool) -> Point:
+        "Return the compressed Point of the block starting (or ending) at x, y."
+        return Point(int(np.searchsorted(xs, x + end)) - end,
+                     int(np.searchsorted(ys, y + end)) - end)
+
+    compressed: list[Instruction] = [
+        {'action': i['action'],
+         'p1': block(min(i['p1'].x, i['p2'].x), min(i['p1'].y, i['p2'].y), False),
+         'p2': block(max(i['p1'].x, i['p2'].x), max(i['p1'].y, i['p2'].y), True)}
+        for i in instructions]
+
+    return (compressed, xs, ys)
+
+
+def compressed_total(instructions: list[Instruction], n: int = 1000,
+                     part_two: bool = False) -> int:
+    """Return the lights on (or the total brightness) of an n by n grid after
+    following instructions, applying them to the blocks of the compressed
+    grid and weighting every block by its area, so n doesn't matter."""
+    compressed, xs, ys = compress_instructions(instructions, n)
+    grid: np.ndarray = np.zeros((len(ys) - 1, len(xs) - 1),
+                                dtype=np.uint32 if part_two else np.uint8)
+    apply = adjust_brightness if part_two else switch_lights
+    for i in compressed:
+        apply(grid, i)
+
+    row_totals: np.ndarray = (grid * np.diff(xs)).sum(axis=1)
+    return sum(int(t) * int(h) for t, h in zip(row_totals, np.diff(ys)))
+
+
+class BitGrid:
+    """On/off grid of width by height lights packed one bit per light in a
+    bytearray, row after row (bit k of a row is column k, little endian)."""
+
+    def __init__(self, width: int = 1000, height: int = 1000):
+        self.width = width
+        self.height = height
+        self.row_bytes: int = -(-width // 8)
+        self.bits: bytearray = bytearray(self.row_bytes * height)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+    def apply(self, i: Instruction) -> None:
+        """Turn on, turn off or toggle the rectangle of instruction i, row by
+        row, with one integer mask over the bytes spanned by its columns."""
+        x1, x2 = sorted((i['p1'].x, i['p2'].x))
+        y1, y2 = sorted((i['p1'].y, i['p2'].y))
+        if x1 < 0 or y1 < 0 or x2 >= self.width or y2 >= self.height:
+            raise IndexError(f"Rectangle out of the grid: {i['p1']} {i['p2']}")
+        lo: int = x1 // 8
+        hi: int = x2 // 8 + 1
+        mask: int = ((1 << (x2 - x1 + 1)) - 1) << (x1 - 8 * lo)
+        for row in range(y1 * self.row_bytes, (y2 + 1) * self.row_bytes, self.row_bytes):
+            span = slice(row + lo, row + hi)
+            bits: int = int.from_bytes(self.bits[span], 'little')
+            match i['action']:
+                case 'turn on':
+                    bits |= mask
+                case 'turn off':
+                    bits &= ~mask
+                case 'toggle':
+                    bits ^= mask
+                case _:
+                    raise RuntimeError(f"Couldn't understand 'action' in: '{i['action']}'")
+            self.bits[span] = bits.to_bytes(hi - lo, 'little')
 
-    return None
+    def count(self) -> int:
+        "Return the number of lights turned on."
+        return sum(int.from_bytes(self.bits[pos : pos + POPCOUNT_CHUNK], 'little').bit_count()
+                   for pos in range(0, len(self.bits), POPCOUNT_CHUNK))
 
 
-def solve1(puzzle: str) -> int:
+def bit_solve1(puzzle: str, n: int = 1000) -> int:
+    "Answer solve1 for an n by n grid using a BitGrid."
+    grid: BitGrid = BitGrid(n, n)
     with open(puzzle) as p:
-        grid: Grid = make_grid()
-        data: list[str] = p.readlines()
-        instructions: list[dict] = [parse_instruction(l) for l in data]
-
+        for l in p:
+            i: Instruction = parse_instruction(l)
+            if i: grid.apply(i)
+
+    return grid.count()
+
+
+class QuadNode:
+    """Node of a LightTree covering columns x0 to x1 and rows y0 to y1 (both
+    exclusive) with the total, lowest and highest value of its lights. A node
+    without children has all its lights equal; otherwise 'lazy' holds the
+    transformation x -> scale * x + shift still owed to its children."""
+
+    def __init__(self, x0: int, y0: int, x1: int, y1: int, value: int = 0):
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        self.area: int = (x1 - x0) * (y1 - y0)
+        self.total: int = value * self.area
+        self.low: int = value
+        self.high: int = value
+        self.lazy: tuple[int, int] | None = None
+        self.children: list['QuadNode'] | None = None
+
+    def transform(self, scale: int, shift: int) -> None:
+        "Apply x -> scale * x + shift (scale is 1, 0 or -1) to every light."
+        if scale == 1:
+            self.total += shift * self.area
+            self.low, self.high = self.low + shift, self.high + shift
+        elif scale == 0:
+            self.total = shift * self.area
+            self.low = self.high = shift
+        else:
+            self.total = shift * self.area - self.total
+            self.low, self.high = shift - self.high, shift - self.low
+
+        if self.children:
+            if self.lazy:
+                s, a = self.lazy
+                self.lazy = (scale * s, scale * a + shift)
+            else:
+                self.lazy = (scale, shift)
+
+    def push(self) -> None:
+        "Split a uniform node in (up to) four, or pass its lazy transformation down."
+        if self.children is None:
+            xm: int = (self.x0 + self.x1 + 1) // 2
+            ym: int = (self.y0 + self.y1 + 1) // 2
+            self.children = [QuadNode(a, b, c, d, self.low)
+                             for a, c in ((self.x0, xm), (xm, self.x1)) if a < c
+                             for b, d in ((self.y0, ym), (ym, self.y1)) if b < d]
+        elif self.lazy:
+            for c in self.children:
+                c.transform(*self.lazy)
+        self.lazy = None
+
+    def update(self, x0: int, y0: int, x1: int, y1: int,
+               op: tuple[int, int] | None) -> None:
+        """Apply op to the lights in the rectangle [x0, x1) x [y0, y1): an
+        (scale, shift) transformation, or None to dim them by one down to
+        zero."""
+        if x1 <= self.x0 or self.x1 <= x0 or y1 <= self.y0 or self.y1 <= y0:
+            return
+        if x0 <= self.x0 and self.x1 <= x1 and y0 <= self.y0 and self.y1 <= y1:
+            if op is not None:
+                return self.transform(*op)
+            if self.low >= 1:
+                return self.transform(1, -1)
+            if self.high <= 0:
+                return
+
+        self.push()
+        for c in self.children:
+            c.update(x0, y0, x1, y1, op)
+        self.total = sum(c.total for c in self.children)
+        self.low = min(c.low for c in self.children)
+        self.high = max(c.high for c in self.children)
+        if self.low == self.high: # uniform again, drop the children
+            self.children = None
+
+    def query(self, x0: int, y0: int, x1: int, y1: int) -> int:
+        "Return the total value of the lights in the rectangle [x0, x1) x [y0, y1)."
+        w: int = min(x1, self.x1) - max(x0, self.x0)
+        h: int = min(y1, self.y1) - max(y0, self.y0)
+        if w <= 0 or h <= 0: return 0
+        if w * h == self.area: return self.total
+        if self.children is None: return self.low * w * h
+
+        self.push()
+        return sum(c.query(x0, y0, x1, y1) for c in self.children)
+
+
+class LightTree:
+    """n by n light grid as a quadtree with lazy propagation, so updating or
+    querying a rectangle only touches the nodes along its border."""
+
+    SWITCH: dict[str, tuple[int, int]] = {'turn on': (0, 1), 'turn off': (0, 0),
+                                          'toggle': (-1, 1)}
+    BRIGHTNESS: dict[str, tuple[int, int] | None] = {'turn on': (1, 1), 'turn off': None,
+                                                     'toggle': (1, 2)}
+
+    def __init__(self, n: int = 1000, part_two: bool = False):
+        self.root: QuadNode = QuadNode(0, 0, n, n)
+        self.ops = self.BRIGHTNESS if part_two else self.SWITCH
+
+    def apply(self, i: Instruction) -> None:
+        "Follow instruction i (first or second part rules)."
+        if i['action'] not in self.ops:
+            raise RuntimeError(f"Couldn't understand 'action' in: '{i['action']}'")
+        x0, x1 = sorted((i['p1'].x, i['p2'].x))
+        y0, y1 = sorted((i['p1'].y, i['p2'].y))
+        self.root.update(x0, y0, x1 + 1, y1 + 1, self.ops[i['action']])
+
+    def total(self, p1: Point | None = None, p2: Point | None = None) -> int:
+        """Return the lights on (or total brightness) in the rectangle of
+        corners p1 and p2 (inclusive), the whole grid by default."""
+        if p1 is None: return self.root.total
+        x0, x1 = sorted((p1.x, p2.x))
+        y0, y1 = sorted((p1.y, p2.y))
+        return self.root.query(x0, y0, x1 + 1, y1 + 1)
+
+
+def lights_in(instructions: list[Instruction], queries: list[tuple[int, Point, Point]],
+              n: int = 1000, part_two: bool = False) -> list[int]:
+    """Return, for each query (k, p1, p2), the lights on (or total brightness)
+    in the rectangle of corners p1 and p2 after following the first k
+    instructions. Queries are answered in order of k on a single tree while
+    the instructions are applied, so the instructions are followed once."""
+    tree: LightTree = LightTree(n, part_two)
+    answers: list[int] = [0] * len(queries)
+    applied: int = 0
+    for q in sorted(range(len(queries)), key=lambda q: queries[q][0]):
+        k, p1, p2 = queries[q]
+        for i in instructions[applied:k]:
+            if i: tree.apply(i)
+        applied = max(applied, k)
+        answers[q] = tree.total(p1, p2)
+
+    return answers
+
+
+class InstructionReplay:
+    """Replays an instruction file that keeps growing, keeping a zlib
+    compressed snapshot of the grid every 'every' instructions so that the
+    state after any instruction is rebuilt from the nearest snapshot."""
+
+    def __init__(self, puzzle: str, n: int = 1000, part_two: bool = False,
+                 every: int = SNAPSHOT_EVERY):
+        self.puzzle = puzzle
+        self.every = every
+        self.apply = adjust_brightness if part_two else switch_lights
+        self.grid: np.ndarray = np.zeros((n, n), dtype=np.uint32 if part_two else np.uint8)
+        self.instructions: list[Instruction] = [] # None for blank lines
+        self.snapshots: dict[int, bytes] = {0: zlib.compress(self.grid.tobytes(), 1)}
+        self.offset: int = 0 # bytes of puzzle already replayed
+        self.refresh()
+
+    def refresh(self) -> int:
+        """Follow the complete lines appended to the file since the last call
+        and return how many there were."""
+        with open(self.puzzle, 'rb') as p:
+            p.seek(self.offset)
+            data: bytes = p.read()
+        data = data[: data.rfind(b'\n') + 1]
+        self.offset += len(data)
+
+        lines: list[str] = data.decode().splitlines()
+        for l in lines:
+            i: Instruction = parse_instruction(l)
+            if i: self.apply(self.grid, i)
+            self.instructions.append(i)
+            if len(self.instructions) % self.every == 0:
+                self.snapshots[len(self.instructions)] = zlib.compress(self.grid.tobytes(), 1)
+
+        return len(lines)
+
+    def state_at(self, k: int) -> np.ndarray:
+        "Return the grid after the first k instructions."
+        if not 0 <= k <= len(self.instructions):
+            raise IndexError(f"Instruction out of range: {k}")
+        if k == len(self.instructions): return self.grid.copy()
+
+        start: int = k - k % self.every
+        grid: np.ndarray = np.frombuffer(zlib.decompress(self.snapshots[start]),
+                                         dtype=self.grid.dtype).reshape(self.grid.shape).copy()
+        for i in self.instructions[start:k]:
+            if i: self.apply(grid, i)
+
+        return grid
+
+    def total_at(self, k: int) -> int:
+        "Return the lights on (or total brightness) after the first k instructions."
+        return int(self.state_at(k).sum(dtype=np.uint64))
+
+
+def tile_instructions(instructions: list[Instruction], x0: int, y0: int,
+                      x1: int, y1: int) -> list[Instruction]:
+    """Return, in order, the instructions whose rectangles intersect the tile
+    of columns x0 to x1 and rows y0 to y1 (exclusive), clipped to the tile
+    and with Points relative to its corner."""
+    clipped: list[Instruction] = []
+    for i in instructions:
+        if not i: continue
+        ix0, ix1 = sorted((i['p1'].x, i['p2'].x))
+        iy0, iy1 = sorted((i['p1'].y, i['p2'].y))
+        if ix1 < x0 or x1 <= ix0 or iy1 < y0 or y1 <= iy0: continue
+        clipped.append({'action': i['action'],
+                        'p1': Point(max(ix0, x0) - x0, max(iy0, y0) - y0),
+                        'p2': Point(min(ix1, x1 - 1) - x0, min(iy1, y1 - 1) - y0)})
+
+    return clipped
+
+
+def run_tile(name: str, n: int, part_two: bool, bounds: tuple[int, int, int, int],
+             instructions: list[Instruction]) -> int:
+    """Follow the (tile relative) instructions on the tile of the shared n by
+    n grid called name and return the tile total."""
+    shm: SharedMemory = SharedMemory(name)
+    try:
+        grid = np.ndarray((n, n), dtype=np.uint32 if part_two else np.uint8, buffer=shm.buf)
+        x0, y0, x1, y1 = bounds
+        tile: np.ndarray = grid[y0:y1, x0:x1]
+        apply = adjust_brightness if part_two else switch_lights
         for i in instructions:
+            apply(tile, i)
+        total: int = int(tile.sum(dtype=np.uint64))
+        del grid, tile
+    finally:
+        shm.close()
+
+    return total
+
+
+def parallel_total(instructions: list[Instruction], n: int = 1000, part_two: bool = False,
+                   tile: int = TILE_SIZE, workers: int | None = None) -> int:
+    """Return the lights on (or total brightness) of an n by n grid after
+    following instructions, with the grid in shared memory split in tiles
+    that a pool of workers fills in independently."""
+    itemsize: int = 4 if part_two else 1
+    shm: SharedMemory = SharedMemory(create=True, size=max(1, n * n * itemsize)) # zeroed
+    try:
+        tiles: list[tuple[int, int, int, int]] = [
+            (x, y, min(x + tile, n), min(y + tile, n))
+            for y in range(0, n, tile) for x in range(0, n, tile)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            totals = pool.map(run_tile, [shm.name] * len(tiles), [n] * len(tiles),
+                              [part_two] * len(tiles), tiles,
+                              [tile_instructions(instructions, *t) for t in tiles])
+            return sum(totals)
+    finally:
+        shm.close()
+        shm.unlink()
 
-            # Loop if we parsed a blank or incorrect line as None
-            if not i: continue
-
-            for p in make_rectangle(i['p1'], i['p2']):
-
-                if i['action'] == 'turn on':
-                    turn_on(p, grid)
-                elif i['action'] == 'turn off':
-                    turn_off(p, grid)
-                elif i['action'] == 'toggle':
-                    toggle(p, grid)
-                else:
-                    raise RuntimeError
-
-        return sum((sum(row) for row in grid))
-
-
-def is_turned_off(p: Point, g: Grid) -> bool:
-    if g[p.y][p.x] == 0:
-        return True
-    else:
-        return False
 
-
-def correct_turn_on(p: Point, g: Grid) -> int:
-    "Add 1 to brightness level of Point"
-    g[p.y][p.x] += 1
-    return None
-
-
-def correct_turn_off(p: Point, g: Grid) -> int:
-    "Substract 1 to brightness level of Point."
-    if is_turned_off(p, g):
-        return None
-    else:
-        g[p.y][p.x] -= 1
-        return None
-
-
-def correct_toggle(p: Point, g: Grid) -> int:
-    "Add 2 to the brightness level of Point."
-    g[p.y][p.x] += 2
-    return None
+def solve1(puzzle: str) -> int:
+    with open(puzzle) as p:
+        instructions: list[Instruction] = [parse_instruction(l) for l in p]
+        return int(light_grid(instructions).sum())
 
 
 def solve2(puzzle: str) -> int:
     with open(puzzle) as p:
-        grid: Grid = make_grid()
-        lines: list[str] = p.readlines()
-        instructions: list[dict] = [parse_instruction(l) for l in lines]
-
-        for i in instructions:
-            # Skip i if we parsed a blank or malformed line as None
-            if not i: continue
-
-            for p in make_rectangle(i['p1'], i['p2']):
-
-                if i['action'] == 'turn on':
-                    correct_turn_on(p, grid)
-                elif i['action'] == 'turn off':
-                    correct_turn_off(p, grid)
-                elif i['action'] == 'toggle':
-                    correct_toggle(p, grid)
-                else:
-                    raise RuntimeError(f"Couldn't understand 'action' in: '{i['action']}'")
-
-        return sum((sum(row) for row in grid))
+        instructions: list[Instruction] = [parse_instruction(l) for l in p]
+        return int(light_grid(instructions, part_two=True).sum(dtype=np.uint64))
 
 
 ### TESTS
 
-def test_make_rectangle():
-    assert len(make_rectangle(Point(0, 0), Point(2, 2))) == 9
-    rectangle = make_rectangle(Point(1, 1), Point(0, 0))
-    points = [Point(0, 0), Point(0, 1), Point(1, 0), Point(1, 1)]
-    assert all((p in rectangle for p in points))
-
-
-def test_make_grid():
-    assert len(make_grid()) == 1000
-    assert len(make_grid()[69]) == 1000
-    assert make_grid()[420][69] == 0
-    assert len({id(row) for row in make_grid()}) == 1000
-
-
 def test_parse_instructions():
     assert parse_instruction('turn on 294,132 through 460,338') == {'action' : 'turn on', 'p1' : Point(294, 132), 'p2' : (460, 338)}
     assert parse_instruction('turn off 294,132 through 460,338') == {'action' : 'turn off', 'p1' : Point(294, 132), 'p2' : (460, 338)}
@@ -273,3 +554,139 @@ def test_solve1():
 def test_solve2():
     assert solve2(TEST_FILE) == (3 * 1000000) - 4
     assert solve2(PUZZLE_FILE) == 14110788
+
+
+def test_light_grid():
+    instructions = [parse_instruction('turn on 0,0 through 2,2'),
+                    None,
+                    parse_instruction('toggle 2,1 through 1,3'),
+                    parse_instruction('turn off 0,0 through 0,0')]
+    assert light_grid(instructions, n=4).tolist() == [[0, 1, 1, 0],
+                                                      [1, 0, 0, 0],
+                                                      [1, 0, 0, 0],
+                                                      [0, 1, 1, 0]]
+    assert light_grid(instructions, n=4, part_two=True).tolist() == [[0, 1, 1, 0],
+                                                                     [1, 3, 3, 0],
+                                                                     [1, 3, 3, 0],
+                                                                     [0, 2, 2, 0]]
+    assert light_grid([parse_instruction('turn off 0,0 through 3,3')], 4, True).sum() == 0
+
+
+def test_compress_instructions():
+    compressed, xs, ys = compress_instructions([parse_instruction('turn on 2,1 through 0,3'),
+                                                None], n=5)
+    assert xs.tolist() == [0, 3, 5]
+    assert ys.tolist() == [0, 1, 4, 5]
+    assert compressed == [{'action': 'turn on', 'p1': Point(0, 1), 'p2': Point(0, 1)}]
+
+
+def test_compressed_total():
+    with open(PUZZLE_FILE) as p:
+        instructions = [parse_instruction(l) for l in p]
+    assert compressed_total(instructions) == 377891
+    assert compressed_total(instructions, part_two=True) == 14110788
+    with open(TEST_FILE) as p:
+        instructions = [parse_instruction(l) for l in p]
+    assert compressed_total(instructions, n=10 ** 9) == 4
+    assert compressed_total(instructions, n=10 ** 9, part_two=True) == 3 * 10 ** 6 - 4
+    instructions = [parse_instruction('toggle 0,0 through 999999999,999999999'),
+                    parse_instruction('turn off 5,5 through 6,6'),
+                    parse_instruction('turn off 5,5 through 5,5')]
+    assert compressed_total(instructions, n=10 ** 9) == 10 ** 18 - 4
+    assert compressed_total(instructions, n=10 ** 9, part_two=True) == 2 * 10 ** 18 - 5
+
+
+def test_bit_grid():
+    grid = BitGrid(10, 3)
+    assert grid.nbytes == 6
+    grid.apply(parse_instruction('turn on 9,0 through 3,2'))
+    grid.apply(parse_instruction('toggle 0,1 through 7,1'))
+    grid.apply(parse_instruction('turn off 9,2 through 9,2'))
+    assert grid.count() == 7 + 5 + 6
+    assert grid.bits[2:4] == bytes([0b00000111, 0b00000011])
+    assert BitGrid().nbytes == 125000
+    for outside in ('turn on 8,0 through 12,0', 'toggle 0,3 through 1,3'):
+        with pytest.raises(IndexError):
+            grid.apply(parse_instruction(outside))
+    assert grid.count() == 7 + 5 + 6
+
+
+def test_bit_solve1():
+    assert bit_solve1(TEST_FILE) == solve1(TEST_FILE)
+    assert bit_solve1(PUZZLE_FILE) == 377891
+
+
+def test_light_tree():
+    rng = np.random.default_rng(6)
+    actions = ['turn on', 'turn off', 'toggle']
+    instructions = [{'action': actions[rng.integers(3)],
+                     'p1': Point(*rng.integers(0, 40, 2).tolist()),
+                     'p2': Point(*rng.integers(0, 40, 2).tolist())} for __ in range(60)]
+    for part_two in (False, True):
+        tree = LightTree(40, part_two)
+        for k, i in enumerate(instructions, 1):
+            tree.apply(i)
+            grid = light_grid(instructions[:k], 40, part_two)
+            assert tree.total() == grid.sum()
+            p1, p2 = Point(*rng.integers(0, 40, 2).tolist()), Point(*rng.integers(0, 40, 2).tolist())
+            assert tree.total(p1, p2) == grid[rectangle_slices(p1, p2)].sum()
+
+
+def test_lights_in():
+    with open(PUZZLE_FILE) as p:
+        instructions = [parse_instruction(l) for l in p]
+    corners = (Point(0, 0), Point(999, 999))
+    queries = [(len(instructions), *corners), (1, Point(885, 9), Point(890, 10)), (0, *corners)]
+    assert lights_in(instructions, queries) == [377891, 4 * 2, 0]
+    assert lights_in(instructions, queries[:1], part_two=True) == [14110788]
+    assert lights_in(instructions, []) == []
+
+    rng = np.random.default_rng(23)
+    queries = [(int(rng.integers(len(instructions) + 1)),
+                Point(*rng.integers(0, 1000, 2).tolist()),
+                Point(*rng.integers(0, 1000, 2).tolist())) for __ in range(20)]
+    expected = [light_grid(instructions[:k])[rectangle_slices(p1, p2)].sum()
+                for k, p1, p2 in queries[:3]]
+    assert lights_in(instructions, queries)[:3] == expected
+
+
+def test_instruction_replay(tmp_path):
+    with open(PUZZLE_FILE) as p:
+        lines = p.readlines()
+    puzzle = tmp_path / 'puzzle'
+    puzzle.write_text(''.join(lines[:120]) + lines[120][:10])
+    replay = InstructionReplay(puzzle, every=25)
+    assert len(replay.instructions) == 120
+    assert sorted(replay.snapshots) == [0, 25, 50, 75, 100]
+
+    with open(puzzle, 'a') as p:
+        p.write(lines[120][10:] + ''.join(lines[121:]))
+    assert replay.refresh() == len(lines) - 120
+    assert replay.refresh() == 0
+    assert replay.total_at(len(lines)) == 377891
+    for k in (0, 1, 24, 25, 26, 199):
+        instructions = [parse_instruction(l) for l in lines[:k]]
+        assert (replay.state_at(k) == light_grid(instructions)).all()
+
+    replay = InstructionReplay(PUZZLE_FILE, part_two=True)
+    assert replay.total_at(len(lines)) == 14110788
+    assert replay.total_at(120) == light_grid([parse_instruction(l) for l in lines[:120]],
+                                              part_two=True).sum()
+
+
+def test_tile_instructions():
+    instructions = [parse_instruction('turn on 0,0 through 9,9'), None,
+                    parse_instruction('toggle 12,3 through 2,4')]
+    assert tile_instructions(instructions, 10, 0, 20, 10) == [
+        {'action': 'toggle', 'p1': Point(0, 3), 'p2': Point(2, 4)}]
+    assert tile_instructions(instructions, 10, 10, 20, 20) == []
+
+
+def test_parallel_total():
+    with open(PUZZLE_FILE) as p:
+        instructions = [parse_instruction(l) for l in p]
+    assert parallel_total(instructions, workers=2) == 377891
+    assert parallel_total(instructions, part_two=True, tile=300, workers=2) == 14110788
+    with open(TEST_FILE) as p:
+        instructions = [parse_instruction(l) for l in p]
+    assert parallel_total(instructions, part_two=True, tile=999) == solve2(TEST_FILE)